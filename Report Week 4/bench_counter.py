@@ -0,0 +1,203 @@
+"""Đo thông lượng và độ trễ của /page/<site> với nhiều client đồng thời.
+
+    python bench_counter.py --requests 20000 --concurrency 32 --sites 100 --json result.json
+    python bench_counter.py --url http://localhost:5000 --requests 5000
+
+Không có --url thì chạy trong tiến trình bằng Flask test client trên một DB tạm, mỗi chế độ
+PAGEVIEW_DURABILITY (--durability) chạy trong một tiến trình con riêng để đo peak RSS riêng.
+Kết quả in ra dạng JSON để so sánh giữa các commit.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# percentile/summarize giống hệt nhau trong bench_counter.py (Week 4), bench_qa.py (Week 5) và
+# bench_submit.py (Week 6): mỗi tuần là một thư mục chạy độc lập nên chép thay vì import; sửa thì sửa cả ba
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 4),
+        'p50_ms': round(percentile(values, 50) * 1000, 4),
+        'p95_ms': round(percentile(values, 95) * 1000, 4),
+        'p99_ms': round(percentile(values, 99) * 1000, 4),
+        'max_ms': round(values[-1] * 1000, 4),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def workload(requests_count, sites, seed):
+    rng = random.Random(seed)
+    return [f'site{rng.randrange(sites)}' for _ in range(requests_count)]
+
+
+def drive(call, sites, concurrency):
+    """Gọi call(site) cho từng site từ concurrency luồng; trả (độ trễ từng request, lỗi, thời gian chạy)."""
+    def timed(site):
+        start = time.perf_counter()
+        ok = call(site)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, sites))
+    elapsed = time.perf_counter() - start
+    return [latency for latency, _ in outcomes], sum(1 for _, ok in outcomes if not ok), elapsed
+
+
+def run_local(args):
+    # Import sau khi đặt biến môi trường: main.py đọc cấu hình lúc import
+    db_dir = tempfile.mkdtemp(prefix='pageview-bench-')
+    os.environ['PAGEVIEW_DB'] = os.path.join(db_dir, 'pageviews.db')
+    os.environ['PAGEVIEW_DURABILITY'] = args.durability
+    os.environ['PAGEVIEW_STORAGE'] = args.storage
+    import main
+
+    stages = {}
+    start = time.perf_counter()
+    main.init_db()
+    stages['init_db_s'] = round(time.perf_counter() - start, 4)
+
+    client = main.app.test_client()
+    sites = workload(args.requests, args.sites, args.seed)
+
+    def call(site):
+        return client.get(f'/page/{site}').status_code == 200
+
+    latencies, errors, elapsed = drive(call, sites, args.concurrency)
+    start = time.perf_counter()
+    main.counter.flush()
+    stages['final_flush_s'] = round(time.perf_counter() - start, 4)
+    if args.storage == 'buckets':
+        start = time.perf_counter()
+        main.counter.rollup()
+        stages['rollup_s'] = round(time.perf_counter() - start, 4)
+
+    # Kiểm tra không mất lượt xem: tổng trong DB phải bằng số request thành công
+    stored = main.pool.connection().execute('SELECT COALESCE(SUM(count), 0) FROM pageviews').fetchone()[0]
+    main.counter.stop()
+    shutil.rmtree(db_dir, ignore_errors=True)
+    return {
+        'mode': 'local',
+        'durability': args.durability,
+        'storage': args.storage,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'sites': args.sites,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'ops_per_sec': round(len(latencies) / elapsed, 1),
+        'latency': summarize(latencies),
+        'stages': stages,
+        'stored_views': stored,
+        'lost_views': args.requests - errors - stored,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_remote(args):
+    import threading
+    import requests
+
+    local = threading.local()
+
+    def call(site):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            return session.get(f"{args.url.rstrip('/')}/page/{site}", timeout=30).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    latencies, errors, elapsed = drive(call, workload(args.requests, args.sites, args.seed), args.concurrency)
+    return {
+        'mode': 'remote',
+        'url': args.url,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'sites': args.sites,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'ops_per_sec': round(len(latencies) / elapsed, 1),
+        'latency': summarize(latencies),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark bộ đếm lượt xem /page/<site>')
+    parser.add_argument('--url', help='đo server đang chạy thay vì chạy trong tiến trình')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--sites', type=int, default=50, help='số site khác nhau được truy cập')
+    parser.add_argument('--durability', nargs='+', default=['relaxed', 'strict'], choices=['relaxed', 'strict'])
+    parser.add_argument('--storage', default='buckets', choices=['buckets', 'total'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.durability = args.durability[0]
+        print(json.dumps(run_local(args)))
+        return
+
+    if args.url:
+        runs = [run_remote(args)]
+    else:
+        runs = []
+        for durability in args.durability:
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', '--durability', durability,
+                   '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                   '--sites', str(args.sites), '--storage', args.storage, '--seed', str(args.seed)]
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {
+        'benchmark': 'pageview_counter',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': runs,
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,52 +1,365 @@
-from flask import Flask, render_template_string
-import sqlite3, os
+from flask import Flask, render_template_string, request, jsonify
+from datetime import datetime, timezone
+from collections import OrderedDict
+import sqlite3, os, threading, atexit, signal, sys, time
+import metrics
 
 app = Flask(__name__)
-DB_FILE = 'pageviews.db'
+metrics.instrument_app(app)
+DB_FILE = os.getenv('PAGEVIEW_DB', 'pageviews.db')
+# Ghi lượt xem xuống DB sau mỗi FLUSH_INTERVAL giây hoặc khi đủ FLUSH_BATCH_SIZE lượt chờ ghi
+FLUSH_INTERVAL = float(os.getenv('PAGEVIEW_FLUSH_INTERVAL', '1.0'))
+FLUSH_BATCH_SIZE = int(os.getenv('PAGEVIEW_FLUSH_BATCH_SIZE', '1000'))
+# Số site tối đa giữ tổng lượt xem trong bộ nhớ; site ít dùng nhất (không còn lượt chờ ghi) bị bỏ,
+# lần sau đọc lại từ DB
+MAX_CACHED_SITES = int(os.getenv('PAGEVIEW_MAX_CACHED_SITES', '10000'))
+# strict: synchronous=FULL và ghi xuống DB trước khi trả response; số lượt xem trả về đọc lại từ DB
+#         trong cùng transaction nên đúng cả khi chạy nhiều worker/tiến trình trên một DB
+# relaxed: synchronous=NORMAL (WAL chỉ fsync lúc checkpoint) và ghi trễ theo lô; số lượt xem trả về
+#          là số của tiến trình này cộng lượt của worker khác tính tới lần flush gần nhất (trễ tối đa
+#          khoảng FLUSH_INTERVAL giây)
+DURABILITY = os.getenv('PAGEVIEW_DURABILITY', 'relaxed')
+SYNCHRONOUS_LEVELS = {'strict': 'FULL', 'relaxed': 'NORMAL'}
+
+# Lưu thêm lượt xem theo bucket thời gian (buckets) hay chỉ tổng lượt xem (total)
+STORAGE_MODE = os.getenv('PAGEVIEW_STORAGE', 'buckets')
+MINUTE, HOUR, DAY = 60, 3600, 86400
+# Bucket phút cũ hơn 1 ngày gộp thành bucket giờ, bucket giờ cũ hơn 30 ngày gộp thành bucket ngày
+ROLLUPS = [(MINUTE, HOUR, DAY), (HOUR, DAY, 30 * DAY)]
+ROLLUP_INTERVAL = float(os.getenv('PAGEVIEW_ROLLUP_INTERVAL', '60'))
+# Khoảng thời gian nhận được cho from/to của /stats: 0001-01-01 .. 9999-12-31 (UTC)
+MIN_TIMESTAMP, MAX_TIMESTAMP = -62135596800, 253402300799
+
+SELECT_SQL = 'SELECT count FROM pageviews WHERE site = ?'
+SELECT_MANY_SQL = 'SELECT site, count FROM pageviews WHERE site IN ({})'
+# Giữ dưới giới hạn số tham số của SQLite bản cũ (999)
+SELECT_MANY_CHUNK = 500
+
+UPSERT_SQL = '''
+    INSERT INTO pageviews (site, count) VALUES (?, ?)
+    ON CONFLICT(site) DO UPDATE SET count = count + excluded.count
+'''
+
+BUCKET_UPSERT_SQL = '''
+    INSERT INTO pageview_buckets (site, bucket_start, granularity, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT(site, bucket_start, granularity) DO UPDATE SET count = count + excluded.count
+'''
+
+ROLLUP_SQL = '''
+    INSERT INTO pageview_buckets (site, bucket_start, granularity, count)
+    SELECT site, bucket_start - bucket_start % :coarse, :coarse, SUM(count)
+    FROM pageview_buckets
+    WHERE granularity = :fine AND bucket_start < :cutoff
+    GROUP BY site, bucket_start - bucket_start % :coarse
+    ON CONFLICT(site, bucket_start, granularity) DO UPDATE SET count = count + excluded.count
+'''
+
+ROLLUP_DELETE_SQL = 'DELETE FROM pageview_buckets WHERE granularity = :fine AND bucket_start < :cutoff'
+
+STATS_SQL = '''
+    SELECT bucket_start, granularity, count FROM pageview_buckets
+    WHERE site = ? AND bucket_start >= ? AND bucket_start < ?
+    ORDER BY bucket_start, granularity
+'''
+
+STAGE_SECONDS = metrics.histogram('pageview_stage_seconds', 'Thời gian từng bước của bộ đếm lượt xem', ['stage'])
+FLUSHED_VIEWS = metrics.counter('pageview_flushed_views_total', 'Số lượt xem đã ghi xuống DB')
+FLUSH_ERRORS = metrics.counter('pageview_flush_errors_total', 'Số lần ghi xuống DB bị lỗi')
+
+class SQLitePool:
+    """Mỗi luồng giữ một kết nối SQLite mở sẵn (WAL), dùng lại cho mọi truy vấn."""
+
+    def __init__(self, db_file, durability=DURABILITY):
+        if durability not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"PAGEVIEW_DURABILITY không hợp lệ: {durability} (strict|relaxed)")
+        self.db_file = db_file
+        self.durability = durability
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self):
+        # check_same_thread=False chỉ để close_all() đóng được kết nối của luồng khác;
+        # mỗi kết nối vẫn chỉ được dùng bởi luồng đã mở nó.
+        # cached_statements: sqlite3 giữ sẵn câu lệnh đã prepare theo chuỗi SQL
+        conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False, cached_statements=64)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={SYNCHRONOUS_LEVELS[self.durability]}')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+pool = SQLitePool(DB_FILE)
 
 def init_db():
-    if not os.path.exists(DB_FILE):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
+    with pool.connection() as conn:
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS pageviews (
                 site TEXT PRIMARY KEY,
                 count INTEGER DEFAULT 0
             )
         ''')
-        conn.commit()
-        conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pageview_buckets (
+                site TEXT NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                granularity INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (site, bucket_start, granularity)
+            ) WITHOUT ROWID
+        ''')
+
+def rollup_buckets(conn, now=None):
+    """Gộp bucket mịn đã cũ thành bucket thô hơn để kích thước DB không tăng theo số lượt xem."""
+    now = int(now if now is not None else time.time())
+    with conn:
+        for fine, coarse, retention in ROLLUPS:
+            # Cắt ở biên bucket thô để mỗi bucket thô được gộp trọn một lần
+            cutoff = (now - retention) // coarse * coarse
+            params = {'fine': fine, 'coarse': coarse, 'cutoff': cutoff}
+            conn.execute(ROLLUP_SQL, params)
+            conn.execute(ROLLUP_DELETE_SQL, params)
+
+def query_stats(conn, site, start, end):
+    """Tổng lượt xem của các bucket bắt đầu trong [start, end); độ chính xác bằng độ dài bucket."""
+    rows = conn.execute(STATS_SQL, (site, start, end)).fetchall()
+    return {
+        'site': site,
+        'from': start,
+        'to': end,
+        'views': sum(row[2] for row in rows),
+        'buckets': [{'start': b, 'granularity': g, 'count': c} for b, g, c in rows],
+    }
+
+class PageViewCounter:
+    """Bộ đếm ghi trễ: cộng dồn lượt xem trong bộ nhớ rồi ghi xuống SQLite theo lô."""
+
+    def __init__(self, pool, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE,
+                 storage_mode=STORAGE_MODE, rollup_interval=ROLLUP_INTERVAL,
+                 max_cached_sites=MAX_CACHED_SITES):
+        self.pool = pool
+        self.storage_mode = storage_mode
+        self.rollup_interval = rollup_interval
+        self._last_rollup = 0.0
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.max_cached_sites = max_cached_sites
+        # site -> tổng lượt xem (đã ghi + đang chờ), theo thứ tự dùng gần nhất
+        self._totals = OrderedDict()
+        self._pending = {}  # (site, đầu phút) -> lượt xem chưa ghi xuống DB
+        self._pending_total = 0
+        self._flushes = 0   # số lần flush thành công, để increment biết giá trị đọc từ DB có còn mới
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='pageview-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        self.pool.close_all()
+
+    def _load(self, site):
+        with STAGE_SECONDS.time('load'):
+            row = self.pool.connection().execute(SELECT_SQL, (site,)).fetchone()
+        return row[0] if row else 0
+
+    def increment(self, site):
+        if self._thread is None:
+            self.start()
+        key = (site, int(time.time()) // MINUTE * MINUTE)
+        while True:
+            with self._lock:
+                if site in self._totals:
+                    self._totals[site] += 1
+                    self._totals.move_to_end(site)
+                    self._pending[key] = self._pending.get(key, 0) + 1
+                    self._pending_total += 1
+                    count = self._totals[site]
+                    full = self._pending_total >= self.batch_size
+                    break
+                generation = self._flushes
+            # Đọc DB ngoài khóa rồi kiểm tra lại trong khóa: nếu luồng khác đã nạp site, hoặc đã có lần
+            # flush xong (có thể vừa ghi rồi bỏ site khỏi bộ nhớ) thì giá trị vừa đọc có thể cũ, đọc lại
+            base = self._load(site)
+            with self._lock:
+                if site not in self._totals and self._flushes == generation:
+                    self._totals[site] = base
+        if self.pool.durability == 'strict':
+            self.flush()
+            # flush() đã ghi lượt xem này và cập nhật tổng theo DB (gồm lượt của worker khác)
+            with self._lock:
+                count = self._totals.get(site, count)
+        elif full:
+            self._wakeup.set()
+        return count
+
+    def get(self, site):
+        if self.pool.durability != 'strict':
+            with self._lock:
+                if site in self._totals:
+                    return self._totals[site]
+        return self._load(site)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_total = 0
+            if not batch:
+                return 0
+            per_site = {}
+            for (site, _), n in batch.items():
+                per_site[site] = per_site.get(site, 0) + n
+            try:
+                with STAGE_SECONDS.time('flush'), self.pool.connection() as conn:
+                    conn.executemany(UPSERT_SQL, per_site.items())
+                    if self.storage_mode == 'buckets':
+                        conn.executemany(BUCKET_UPSERT_SQL,
+                                         [(site, minute, MINUTE, n) for (site, minute), n in batch.items()])
+                    stored = self._read_counts(conn, list(per_site))
+            except sqlite3.Error:
+                FLUSH_ERRORS.inc()
+                # Trả lượt xem về hàng chờ để lần flush sau ghi lại
+                with self._lock:
+                    for key, n in batch.items():
+                        self._pending[key] = self._pending.get(key, 0) + n
+                    self._pending_total += sum(batch.values())
+                raise
+            FLUSHED_VIEWS.inc(amount=sum(batch.values()))
+            with self._lock:
+                self._flushes += 1
+                # Tổng trong DB (mọi worker) cộng lượt của tiến trình này đến sau khi lấy lô
+                waiting = {}
+                for (site, _), n in self._pending.items():
+                    waiting[site] = waiting.get(site, 0) + n
+                for site, count in stored.items():
+                    if site in self._totals:
+                        self._totals[site] = count + waiting.get(site, 0)
+            self._evict()
+            return len(per_site)
+
+    def _read_counts(self, conn, sites):
+        counts = {}
+        for i in range(0, len(sites), SELECT_MANY_CHUNK):
+            chunk = sites[i:i + SELECT_MANY_CHUNK]
+            counts.update(conn.execute(SELECT_MANY_SQL.format(','.join('?' * len(chunk))), chunk))
+        return counts
+
+    def _evict(self):
+        """Bỏ tổng lượt xem của các site dùng lâu nhất khi vượt max_cached_sites.
+
+        DB đã giữ tổng của site không còn lượt chờ ghi nên bỏ khỏi bộ nhớ không mất gì;
+        site còn lượt chờ được giữ lại tới lần flush sau.
+        """
+        with self._lock:
+            excess = len(self._totals) - self.max_cached_sites
+            if excess <= 0:
+                return
+            pending_sites = {site for site, _ in self._pending}
+            for site in list(self._totals):
+                if excess <= 0:
+                    break
+                if site not in pending_sites:
+                    del self._totals[site]
+                    excess -= 1
+
+    def rollup(self):
+        with self._flush_lock, STAGE_SECONDS.time('rollup'):
+            rollup_buckets(self.pool.connection())
+            self._last_rollup = time.time()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.storage_mode == 'buckets' and time.time() - self._last_rollup >= self.rollup_interval:
+                    self.rollup()
+            except sqlite3.Error as e:
+                print(f"Lỗi khi ghi lượt xem xuống DB: {e}")
+
+# Tạo bảng ngay khi import để chạy dưới gunicorn/flask run (không qua __main__) cũng có đủ bảng
+init_db()
+counter = PageViewCounter(pool)
+metrics.gauge_func('pageview_pending_views', 'Số lượt xem đang chờ ghi xuống DB', lambda: counter._pending_total)
 
 def increment_view(site):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT count FROM pageviews WHERE site = ?', (site,))
-    row = cursor.fetchone()
-    if row:
-        cursor.execute('UPDATE pageviews SET count = count + 1 WHERE site = ?', (site,))
-    else:
-        cursor.execute('INSERT INTO pageviews (site, count) VALUES (?, 1)', (site,))
-    conn.commit()
-    conn.close()
+    return counter.increment(site)
 
 def get_views(site):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT count FROM pageviews WHERE site = ?', (site,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else 0
+    return counter.get(site)
+
+def parse_time_arg(value, default):
+    """Nhận unix timestamp hoặc thời gian ISO 8601 (không có múi giờ thì hiểu là UTC)."""
+    if not value:
+        return default
+    try:
+        timestamp = int(float(value))
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        timestamp = int(dt.timestamp())
+    # Giữ trong khoảng SQLite INTEGER lưu được và datetime biểu diễn được (năm 1..9999)
+    if not MIN_TIMESTAMP <= timestamp <= MAX_TIMESTAMP:
+        raise ValueError(f'{value} nằm ngoài khoảng thời gian cho phép')
+    return timestamp
 
 @app.route('/page/<site>')
 def page(site):
-    increment_view(site)
-    count = get_views(site)
+    count = increment_view(site)
     return render_template_string("""
         <h1>{{ site | capitalize }} page</h1>
         <p>Lượt xem: {{ count }}</p>
         <button onclick="window.location.reload()">Refresh</button>
     """, site=site, count=count)
 
+@app.route('/stats/<site>')
+def stats(site):
+    if counter.storage_mode != 'buckets':
+        return jsonify({'error': 'Thống kê theo thời gian cần PAGEVIEW_STORAGE=buckets'}), 400
+    now = int(time.time())
+    try:
+        start = parse_time_arg(request.args.get('from'), 0)
+        end = parse_time_arg(request.args.get('to'), now + 1)
+    except (ValueError, OverflowError, OSError) as e:
+        return jsonify({'error': f'Tham số from/to không hợp lệ: {e}'}), 400
+    if start >= end:
+        return jsonify({'error': 'from phải nhỏ hơn to'}), 400
+    # Ghi nốt lượt xem đang chờ để kết quả gồm cả các lượt vừa xảy ra
+    counter.flush()
+    return jsonify(query_stats(pool.connection(), site, start, end))
+
 if __name__ == '__main__':
-    init_db()
+    # SIGTERM -> thoát bình thường để atexit ghi nốt lượt xem đang chờ
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     app.run(debug=True)
@@ -1,22 +1,181 @@
 import pandas as pd
 import re
-from flask import Flask, request, render_template
-from datetime import datetime
+import os
+import io
+import csv
+import threading
+import contextlib
+import numpy as np
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context
+from datetime import datetime, date
 from chrono_python import parse_date
+from column_store import COLUMNS, build_index, merge_rows, to_day, day_strings, combine, combine_many
+from cache import LRUCache
+from snapshot import open_snapshot
+from query_pool import QueryPool, PoolBusy, PoolTimeout
+import metrics
 
 app = Flask(__name__)
+metrics.instrument_app(app)
+
+PLAN_CACHE_SIZE = int(os.getenv('QA_PLAN_CACHE_SIZE', '1024'))
+RESULT_CACHE_SIZE = int(os.getenv('QA_RESULT_CACHE_SIZE', '256'))
+# Số chuỗi chỉ số dẫn xuất (coin, chỉ số, cửa sổ, cột) giữ lại; cửa sổ lấy từ câu hỏi nên phải có giới hạn
+DERIVED_CACHE_SIZE = int(os.getenv('QA_DERIVED_CACHE_SIZE', '256'))
+# Kết quả liệt kê quá dài không đưa vào cache để bộ nhớ cache có giới hạn
+RESULT_CACHE_MAX_CHARS = int(os.getenv('QA_RESULT_CACHE_MAX_CHARS', '65536'))
+# Nạp dữ liệu từ snapshot .npy (memory-map) thay vì parse CSV mỗi lần khởi động
+USE_SNAPSHOT = os.getenv('QA_SNAPSHOT', '1') != '0'
+SNAPSHOT_DIR = os.getenv('QA_SNAPSHOT_DIR')
+# Số dòng mỗi lần đẩy ra khi stream, và giới hạn số dòng mỗi trang của /api/rows
+STREAM_CHUNK_ROWS = 1000
+DEFAULT_PAGE_ROWS = 100
+MAX_PAGE_ROWS = 1000
+MAX_BATCH_QUERIES = int(os.getenv('QA_MAX_BATCH_QUERIES', '5000'))
+# File CSV được feed nối thêm dòng mới; để trống thì không theo dõi
+INGEST_FILE = os.getenv('QA_INGEST_FILE')
+INGEST_INTERVAL = float(os.getenv('QA_INGEST_INTERVAL', '5'))
+# Chạy dưới gunicorn (gunicorn.conf.py đặt QA_PREFORK=1): luồng nền và pool tiến trình tạo sau khi fork worker
+PREFORK = os.getenv('QA_PREFORK') == '1'
+# Câu hỏi nặng chạy trong QA_PROCESSES tiến trình con (0 = chạy ngay trong tiến trình phục vụ request),
+# tối đa QA_QUEUE_SIZE câu chờ/chạy cùng lúc, mỗi câu tối đa QA_QUERY_TIMEOUT giây
+QA_PROCESSES = int(os.getenv('QA_PROCESSES', '0'))
+QA_QUEUE_SIZE = int(os.getenv('QA_QUEUE_SIZE', '16'))
+QA_QUERY_TIMEOUT = float(os.getenv('QA_QUERY_TIMEOUT', '30'))
+
+NO_COLUMN_MESSAGE = "Không tìm thấy cột phù hợp (open, high, low, close, volume)."
+NO_DATA_MESSAGE = "Không tìm thấy dữ liệu phù hợp với điều kiện."
+
+# Chỉ số dẫn xuất: (mẫu câu hỏi, tên chỉ số, cửa sổ mặc định). Kiểm tra trước từ khóa thống kê vì
+# "trung bình động" chứa "trung bình"
+DERIVED_PATTERNS = [
+    (r'trung b(?:ì|i)nh (?:đ|d)(?:ộ|o)ng(?:\s+(\d+)\s+ng(?:à|a)y)?', 'ma', 7),
+    (r'bi(?:ế|e)n (?:đ|d)(?:ộ|o)ng(?:\s+(\d+)\s+ng(?:à|a)y)?', 'volatility', 30),
+    (r'(?:l(?:ợ|o)i nhu(?:ậ|a)n|l(?:ợ|o)i su(?:ấ|a)t|t(?:ỷ|y) su(?:ấ|a)t sinh l(?:ờ|o)i)(?:\s+h(?:ằ|a)ng ng(?:à|a)y)?', 'return', None),
+    (r's(?:ụ|u)t gi(?:ả|a)m|drawdown', 'drawdown', None),
+]
+MAX_WINDOW = 3650
+
+STAGE_SECONDS = metrics.histogram('qa_stage_seconds', 'Thời gian từng bước xử lý câu hỏi và nạp dữ liệu', ['stage'])
+POOL_REJECTED = metrics.counter('qa_pool_rejected_total', 'Câu hỏi bị từ chối vì pool đầy hoặc quá thời gian', ['reason'])
+
+def untimed(stage):
+    # Thay cho STAGE_SECONDS.time khi không được đo (tiến trình con của QueryPool)
+    return contextlib.nullcontext()
+
+def parse_date_str(date_str):
+    # Ngày dạng YYYY-MM-DD đọc trực tiếp, còn lại để chrono phân tích ngôn ngữ tự nhiên
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    parsed_date = parse_date(date_str)
+    return parsed_date.date() if parsed_date else None
 
 class CryptoQASystem:
     def __init__(self, csv_file):
-        self.df = pd.read_csv(csv_file)
-        self.df['date'] = pd.to_datetime(self.df['date'])
-        self.columns = self.df.columns.str.lower()
+        self.csv_file = csv_file
+        # Câu hỏi đã chuẩn hóa -> (cột, phép tính, điều kiện)
+        self.plan_cache = LRUCache(PLAN_CACHE_SIZE)
+        # (cột, phép tính, điều kiện, phiên bản dữ liệu các coin liên quan) -> câu trả lời
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE)
+        # (coin, phiên bản CoinSeries, chỉ số, cửa sổ, cột) -> CoinSeries của chỉ số dẫn xuất
+        self.derived_cache = LRUCache(DERIVED_CACHE_SIZE)
+        self.version = 0
+        self._reload_lock = threading.Lock()
+        self.coin_pattern = None
+        # QueryPool cho câu hỏi nặng, gắn bởi start_background()
+        self.pool = None
+        self.load()
+        
+    def load(self):
+        # self.index không bao giờ bị sửa tại chỗ: nạp lại/thêm dữ liệu tạo dict mới rồi gán một lần,
+        # truy vấn đang chạy vẫn đọc ảnh chụp cũ nhất quán
+        if USE_SNAPSHOT:
+            try:
+                self.columns, index = open_snapshot(self.csv_file, SNAPSHOT_DIR)
+                self._set_index(index)
+                return
+            except OSError as e:
+                print(f"Không dùng được snapshot, đọc trực tiếp CSV: {e}")
+        df = pd.read_csv(self.csv_file)
+        df['date'] = pd.to_datetime(df['date'])
+        self.columns = list(df.columns.str.lower())
+        # coin -> CoinSeries: các mảng NumPy đã sắp theo ngày, truy vấn không cần copy DataFrame
+        self._set_index(build_index(df))
+        
+    def _set_index(self, index):
+        coins = sorted(index, key=len, reverse=True)
+        self.index = index
+        pattern = re.compile(r'coin.*?\b(' + '|'.join(re.escape(c.lower()) for c in coins) + r')\b')
+        if self.coin_pattern is None or pattern.pattern != self.coin_pattern.pattern:
+            # Kế hoạch đã cache phụ thuộc danh sách coin nhận diện được
+            self.coin_pattern = pattern
+            self.plan_cache.clear()
+        
+    def reload(self):
+        with self._reload_lock, STAGE_SECONDS.time('reload'):
+            self.load()
+            self.version += 1
+            self.result_cache.clear()
+        
+    def append_rows(self, rows):
+        """Thêm các dòng OHLCV mới (list dict hoặc DataFrame) mà không nạp lại toàn bộ dữ liệu.
+        
+        Chỉ các coin có dòng mới được cập nhật (nối thêm vào mảng và chỉ mục tổng hợp,
+        O(số dòng mới)); cache kết quả của các coin khác giữ nguyên.
+        """
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        missing = [col for col in ['coin', 'date'] + COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"Thiếu cột: {', '.join(missing)}")
+        if df.empty:
+            return {'rows': 0, 'coins': [], 'version': self.version}
+        df = df.assign(coin=df['coin'].astype(str).str.strip().str.upper(),
+                       day=pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]').astype(np.int64))
+        # Trùng (coin, ngày) thì dòng sau thắng
+        df = df.drop_duplicates(['coin', 'day'], keep='last').sort_values(['coin', 'day'], kind='stable')
+        updates = {}
+        for coin, group in df.groupby('coin', sort=False):
+            updates[coin] = (group['day'].to_numpy(), {col: group[col].to_numpy(dtype=np.float64) for col in COLUMNS})
+        
+        with self._reload_lock, STAGE_SECONDS.time('append'):
+            index = dict(self.index)
+            for coin, (days, values) in updates.items():
+                index[coin] = merge_rows(index.get(coin), coin, days, values)
+            self._set_index(index)
+            self.version += 1
+        # Kết quả cũ của các coin này (và câu hỏi không lọc coin) không còn được dùng tới
+        self.result_cache.discard_if(lambda key: key[3][0] is None or key[3][0] in updates)
+        return {'rows': len(df), 'coins': list(updates), 'version': self.version}
         
     def clean_query(self, query):
-        return query.lower().strip()
+        return ' '.join(query.lower().split())
     
     def parse_query(self, query):
         query = self.clean_query(query)
+        # Ngày hiện tại nằm trong khóa vì chrono hiểu được ngày tương đối ("hôm qua")
+        key = (query, date.today())
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            with STAGE_SECONDS.time('parse'):
+                plan = self._parse_query(query)
+            self.plan_cache.put(key, plan)
+        return plan
+    
+    def _parse_query(self, query):
+        
+        # Chỉ số dẫn xuất (lợi nhuận, trung bình động, biến động, sụt giảm), bỏ cụm từ đó khỏi câu hỏi
+        derived = None
+        for pattern, metric, default_window in DERIVED_PATTERNS:
+            derived_match = re.search(pattern, query)
+            if derived_match:
+                window = default_window
+                if default_window is not None and derived_match.group(1):
+                    window = min(max(int(derived_match.group(1)), 2), MAX_WINDOW)
+                derived = (metric, window)
+                query = query[:derived_match.start()] + query[derived_match.end():]
+                break
         
         # Từ khóa thống kê
         stats_keywords = {
@@ -29,10 +188,12 @@ class CryptoQASystem:
         
         # Tìm cột được hỏi
         selected_column = None
-        for col in ['open', 'high', 'low', 'close', 'volume']:
+        for col in COLUMNS:
             if col in query:
                 selected_column = col
                 break
+        if derived and not selected_column:
+            selected_column = 'close'
                 
         # Tìm phép tính
         operation = None
@@ -44,17 +205,31 @@ class CryptoQASystem:
         # Tìm điều kiện lọc (coin hoặc date)
         condition = {}
         # Lọc theo coin
-        coin_match = re.search(r'coin.*?(btc|xmr)', query, re.IGNORECASE)
+        coin_match = self.coin_pattern.search(query)
         if coin_match:
             condition['coin'] = coin_match.group(1).upper()
             
+        # Lọc theo khoảng ngày: "từ <ngày> đến <ngày>" hoặc "từ <ngày> đến nay"
+        range_match = re.search(r't(?:ừ|u)\s+(?:ng(?:à|a)y\s+)?(.+?)\s+(?:đ|d)(?:ế|e)n\s+(?:ng(?:à|a)y\s+)?(.+?)(?:\s+của|\s+nơi|$)', query, re.IGNORECASE)
+        if range_match:
+            date_from = parse_date_str(range_match.group(1).strip())
+            date_to_str = range_match.group(2).strip()
+            if date_from:
+                condition['date_from'] = date_from
+            if date_to_str not in ('nay', 'hiện tại', 'hôm nay'):
+                date_to = parse_date_str(date_to_str)
+                if date_to:
+                    condition['date_to'] = date_to
+        
         # Lọc theo ngày
-        date_match = re.search(r'n(?:ơ|o)i\s+ng(?:à|a)y\s+(.+?)(?:\s+là|=|\s|$)', query, re.IGNORECASE)
-        if date_match:
-            date_str = date_match.group(1).strip()
-            parsed_date = parse_date(date_str)
+        date_match = re.search(r'n(?:ơ|o)i\s+ng(?:à|a)y\s+(?:l(?:à|a)\s+|=\s*)?(.+?)(?:\s+của|\s+nơi|$)', query, re.IGNORECASE)
+        if date_match and not range_match:
+            parsed_date = parse_date_str(date_match.group(1).strip())
             if parsed_date:
-                condition['date'] = parsed_date.date()
+                condition['date'] = parsed_date
+        
+        if derived:
+            condition['derived'] = derived
                 
         return selected_column, operation, condition
     
@@ -62,43 +237,360 @@ class CryptoQASystem:
         column, operation, condition = self.parse_query(query)
         
         if not column:
-            return "Không tìm thấy cột phù hợp (open, high, low, close, volume)."
+            return NO_COLUMN_MESSAGE
             
+        index = self.index
+        key = (column, operation, tuple(sorted(condition.items())), data_token(index, condition))
+        result = self.result_cache.get(key)
+        if result is not None:
+            return result
         try:
-            df_temp = self.df.copy()
-            
-            # Áp dụng điều kiện lọc
-            if 'coin' in condition:
-                df_temp = df_temp[df_temp['coin'].str.lower() == condition['coin'].lower()]
-            if 'date' in condition:
-                df_temp = df_temp[df_temp['date'].dt.date == condition['date']]
-                
-            if df_temp.empty:
-                return "Không tìm thấy dữ liệu phù hợp với điều kiện."
-                
-            # Thực hiện phép tính
-            if operation:
-                if operation == 'sum':
-                    result = df_temp[column].sum()
-                elif operation == 'mean':
-                    result = df_temp[column].mean()
-                elif operation == 'max':
-                    result = df_temp[column].max()
-                elif operation == 'min':
-                    result = df_temp[column].min()
-                elif operation == 'count':
-                    result = df_temp[column].count()
-                return f"Kết quả {operation} của {column}: {result:.2f}"
+            if self.pool is not None and is_heavy(operation, condition):
+                result = self._execute_in_pool(column, operation, condition)
             else:
-                # Hiển thị tất cả giá trị
-                result = df_temp[['date', 'coin', column]].to_dict('records')
-                return "\n".join([f"{r['date'].strftime('%Y-%m-%d')} ({r['coin']}): {r[column]:.2f}" for r in result])
-                
+                result = self._execute(column, operation, condition, index)
         except Exception as e:
             return f"Lỗi khi xử lý câu hỏi: {str(e)}"
+        if len(result) <= RESULT_CACHE_MAX_CHARS:
+            self.result_cache.put(key, result)
+        return result
+    
+    def execute_batch(self, queries):
+        """Trả lời nhiều câu hỏi một lượt, kết quả theo đúng thứ tự đầu vào.
+        
+        Các câu hỏi cùng (coin, cột, phép tính) được tính chung: searchsorted trên cả mảng
+        ngày được hỏi và đọc tổng tiền tố / sparse table một lần cho cả nhóm.
+        """
+        index = self.index
+        results = [None] * len(queries)
+        groups = {}
+        for i, query in enumerate(queries):
+            column, operation, condition = self.parse_query(query)
+            if not column:
+                results[i] = NO_COLUMN_MESSAGE
+                continue
+            key = (column, operation, tuple(sorted(condition.items())), data_token(index, condition))
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                results[i] = cached
+                continue
+            coin = condition['coin'].upper() if 'coin' in condition else None
+            groups.setdefault((coin, column, operation, condition.get('derived')), []).append((i, condition, key))
+            
+        for (coin, column, operation, _), items in groups.items():
+            try:
+                with STAGE_SECONDS.time('batch_group'):
+                    answers = self._execute_group(index, coin, column, operation, [condition for _, condition, _ in items])
+            except Exception as e:
+                for i, _, _ in items:
+                    results[i] = f"Lỗi khi xử lý câu hỏi: {str(e)}"
+                continue
+            for (i, _, key), answer in zip(items, answers):
+                results[i] = answer
+                if len(answer) <= RESULT_CACHE_MAX_CHARS:
+                    self.result_cache.put(key, answer)
+        return results
+    
+    def _execute_group(self, index, coin, column, operation, conditions):
+        if coin is not None:
+            series = index.get(coin)
+            series_list = [series] if series is not None else []
+        else:
+            series_list = list(index.values())
+        if 'derived' in conditions[0]:
+            series_list = [self.derived(series, *conditions[0]['derived'], column) for series in series_list]
+        starts = np.array([to_day(c.get('date', c.get('date_from'))) if 'date' in c or 'date_from' in c
+                           else np.iinfo(np.int64).min for c in conditions], dtype=np.int64)
+        ends = np.array([to_day(c.get('date', c.get('date_to'))) if 'date' in c or 'date_to' in c
+                         else np.iinfo(np.int64).max for c in conditions], dtype=np.int64)
+        spans = [(series,) + series.date_ranges(starts, ends) for series in series_list]
+        nonempty = np.zeros(len(conditions), dtype=bool)
+        for _, lo, hi in spans:
+            nonempty |= hi > lo
+            
+        if operation is None:
+            # Liệt kê: ghép các đoạn đã tìm bằng searchsorted cho từng câu hỏi
+            return ["\n".join(format_rows(series, column, lo[q], hi[q]) for series, lo, hi in spans if hi[q] > lo[q])
+                    if nonempty[q] else NO_DATA_MESSAGE for q in range(len(conditions))]
+        partials = [series.range_stats(column, operation, lo, hi) for series, lo, hi in spans]
+        values = combine_many(partials, operation, len(conditions))
+        label = describe(column, conditions[0])
+        return [f"Kết quả {operation} của {label}: {value:.2f}" if ok else NO_DATA_MESSAGE
+                for value, ok in zip(values, nonempty)]
+    
+    def cache_stats(self):
+        return {
+            'version': self.version,
+            'plan_cache': self.plan_cache.stats(),
+            'result_cache': self.result_cache.stats(),
+            'derived_cache': self.derived_cache.stats(),
+        }
+    
+    def derived(self, series, metric, window, column, cached=True):
+        """Chuỗi chỉ số dẫn xuất của một coin, tính một lần rồi giữ trong derived_cache.
+        
+        Khóa gồm phiên bản CoinSeries nên dữ liệu mới nối vào không dùng lại chuỗi cũ; mục cũ tự bị
+        đẩy ra theo LRU.
+        """
+        if not cached:
+            return series.derived(metric, window, column)
+        key = (series.coin, series.version, metric, window, column)
+        result = self.derived_cache.get(key)
+        if result is None:
+            with STAGE_SECONDS.time('derived'):
+                result = series.derived(metric, window, column)
+            self.derived_cache.put(key, result)
+        return result
+    
+    def select(self, condition, index=None, column=None, cached=True):
+        """Các đoạn (series, lo, hi) khớp điều kiện coin/ngày, theo thứ tự coin rồi ngày.
+        
+        Câu hỏi về chỉ số dẫn xuất trả về CoinSeries của chỉ số đó (cùng tên cột `column`).
+        """
+        # Chọn coin bằng tra cứu dict, chọn ngày bằng searchsorted trên mảng ngày đã sắp xếp
+        index = self.index if index is None else index
+        if 'coin' in condition:
+            series = index.get(condition['coin'].upper())
+            series_list = [series] if series is not None else []
+        else:
+            series_list = list(index.values())
+        if 'derived' in condition and column is not None:
+            series_list = [self.derived(series, *condition['derived'], column, cached) for series in series_list]
+        if 'date' in condition:
+            start_day = end_day = to_day(condition['date'])
+        else:
+            start_day = to_day(condition['date_from']) if 'date_from' in condition else None
+            end_day = to_day(condition['date_to']) if 'date_to' in condition else None
+        slices = []
+        for series in series_list:
+            lo, hi = series.date_range(start_day, end_day)
+            if hi > lo:
+                slices.append((series, lo, hi))
+        return slices
+    
+    def _execute(self, column, operation, condition, index, in_pool=False, stage=None):
+        # in_pool: chạy trong tiến trình con của QueryPool, không lấy khóa của histogram hay cache.
+        # stage: hàm tạo context manager bấm giờ từng bước (mặc định ghi vào STAGE_SECONDS; bench_qa.py truyền riêng)
+        if stage is None:
+            stage = untimed if in_pool else STAGE_SECONDS.time
+        with stage('filter'):
+            slices = self.select(condition, index, column, cached=not in_pool)
+        if not slices:
+            return NO_DATA_MESSAGE
+            
+        # Thực hiện phép tính
+        if operation:
+            # Dùng tổng tiền tố / sparse table dựng sẵn: O(1) cho mỗi coin, không quét lại dữ liệu
+            with stage('aggregate'):
+                result = combine([series.range_stat(column, operation, lo, hi) for series, lo, hi in slices], operation)
+            return f"Kết quả {operation} của {describe(column, condition)}: {result:.2f}"
+        else:
+            # Hiển thị tất cả giá trị
+            with stage('render'):
+                return "\n".join(format_rows(series, column, lo, hi) for series, lo, hi in slices)
+    
+    def _execute_in_pool(self, column, operation, condition):
+        try:
+            with STAGE_SECONDS.time('pool'):
+                return self.pool.execute(column, operation, condition)
+        except PoolBusy:
+            POOL_REJECTED.inc('busy')
+            raise
+        except PoolTimeout:
+            POOL_REJECTED.inc('timeout')
+            raise
+    
+    def iter_listing(self, query, chunk_rows=STREAM_CHUNK_ROWS):
+        """Trả kết quả liệt kê từng khối chunk_rows dòng, đọc thẳng từ mảng thay vì dựng cả chuỗi."""
+        column, operation, condition = self.parse_query(query)
+        if not column or operation:
+            yield self.execute_query(query)
+            return
+        slices = self.select(condition, column=column)
+        if not slices:
+            yield NO_DATA_MESSAGE
+            return
+        separator = ""
+        for series, lo, hi in slices:
+            for start in range(lo, hi, chunk_rows):
+                yield separator + format_rows(series, column, start, min(start + chunk_rows, hi))
+                separator = "\n"
+    
+    def page_rows(self, query, limit=DEFAULT_PAGE_ROWS, after_coin=None, after_date=None):
+        """Một trang kết quả liệt kê, sắp theo coin rồi ngày.
+        
+        Con trỏ (after_coin, after_date) lấy từ trường `next` của trang trước. Nếu chỉ có
+        after_date thì mọi coin đều bắt đầu từ sau ngày đó (đủ cho câu hỏi một coin).
+        """
+        column, operation, condition = self.parse_query(query)
+        if not column:
+            raise ValueError(NO_COLUMN_MESSAGE)
+        after_day = to_day(after_date) if after_date else None
+        rows = []
+        has_more = False
+        started = after_coin is None
+        for series, lo, hi in self.select(condition, column=column):
+            if not started:
+                if series.coin != after_coin:
+                    continue
+                started = True
+            if after_day is not None and after_coin in (None, series.coin):
+                lo = max(lo, int(np.searchsorted(series.days, after_day, 'right')))
+            if hi <= lo:
+                continue
+            if len(rows) == limit:
+                has_more = True
+                break
+            end = min(hi, lo + limit - len(rows))
+            values = series.values[column][lo:end]
+            rows.extend({'date': d, 'coin': series.coin, column: None if np.isnan(v) else float(v)}
+                        for d, v in zip(day_strings(series.days[lo:end]), values))
+            if end < hi:
+                has_more = True
+                break
+        next_cursor = None
+        if has_more:
+            next_cursor = {'after_coin': rows[-1]['coin'], 'after_date': rows[-1]['date']}
+        return {'column': column, 'rows': rows, 'next': next_cursor}
+
+def is_heavy(operation, condition):
+    """Liệt kê nhiều ngày hoặc tính trên mọi coin: đáng gửi sang tiến trình con."""
+    return 'coin' not in condition or (operation is None and 'date' not in condition)
+
+def describe(column, condition):
+    """Tên cột trong câu trả lời thống kê, kèm tên chỉ số dẫn xuất nếu có."""
+    if 'derived' not in condition:
+        return column
+    metric, window = condition['derived']
+    labels = {
+        'return': "lợi nhuận ngày, %",
+        'ma': f"trung bình động {window} ngày",
+        'volatility': f"biến động {window} ngày, %",
+        'drawdown': "sụt giảm từ đỉnh, %",
+    }
+    return f"{column} ({labels[metric]})"
+
+def data_token(index, condition):
+    """Khóa phiên bản dữ liệu cho cache kết quả: (coin, phiên bản các CoinSeries được đọc)."""
+    if 'coin' in condition:
+        series = index.get(condition['coin'].upper())
+        return (condition['coin'].upper(), series.version if series is not None else None)
+    return (None, tuple(series.version for series in index.values()))
+
+def format_rows(series, column, lo, hi):
+    dates = day_strings(series.days[lo:hi])
+    values = series.values[column][lo:hi]
+    return "\n".join(f"{d} ({series.coin}): {v:.2f}" for d, v in zip(dates, values))
+
+def parse_ingest_row(header, record):
+    """Một dòng CSV -> dict cho append_rows(), hoặc None nếu dòng hỏng."""
+    row = dict(zip(header, record))
+    try:
+        coin = row['coin'].strip()
+        if not coin:
+            return None
+        parsed = {'coin': coin, 'date': pd.Timestamp(row['date'].strip())}
+        for col in COLUMNS:
+            parsed[col] = float(row[col])
+    except (KeyError, ValueError, TypeError):
+        return None
+    if pd.isna(parsed['date']):
+        return None
+    return parsed
+
+class CsvTailWatcher:
+    """Đọc các dòng mới được nối vào cuối một file CSV và đưa vào CryptoQASystem.append_rows().
+    
+    File có cùng cột với file dữ liệu chính (coin,date,open,high,low,close,volume), dòng tiêu đề
+    là tùy chọn. Chỉ đọc phần từ vị trí lần trước tới dòng hoàn chỉnh cuối cùng. Dòng hỏng (thiếu cột,
+    ngày hoặc số không đọc được) được ghi log rồi bỏ qua; vị trí đọc chỉ tiến lên sau khi nạp thành công.
+    """
+    
+    def __init__(self, qa_system, path, interval=INGEST_INTERVAL):
+        self.qa_system = qa_system
+        self.path = path
+        self.interval = interval
+        self.offset = 0
+        self.header = None
+        self._stopped = threading.Event()
+        self._thread = None
+        
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='csv-tail-watcher', daemon=True)
+        self._thread.start()
+        
+    def stop(self):
+        self._stopped.set()
+        
+    def poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.offset:
+            # File bị cắt ngắn/ghi lại từ đầu: đọc lại toàn bộ (dòng trùng ngày sẽ ghi đè)
+            self.offset, self.header = 0, None
+        if size == self.offset:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return 0
+        records = [r for r in csv.reader(io.StringIO(data[:end].decode('utf-8', errors='replace'))) if r]
+        header = self.header
+        if header is None and records:
+            first = [c.strip().lower() for c in records[0]]
+            if 'coin' in first and 'date' in first:
+                header = first
+                records = records[1:]
+            else:
+                header = ['coin', 'date'] + COLUMNS
+        rows = []
+        for record in records:
+            row = parse_ingest_row(header, record)
+            if row is None:
+                print(f"Bỏ qua dòng không hợp lệ trong {self.path}: {','.join(record)[:200]}")
+            else:
+                rows.append(row)
+        added = self.qa_system.append_rows(rows)['rows'] if rows else 0
+        # Lỗi khi nạp (raise ở trên) thì giữ nguyên vị trí để lần sau đọc lại các dòng này
+        self.offset += end + 1
+        self.header = header
+        return added
+        
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                added = self.poll()
+                if added:
+                    print(f"Đã nạp {added} dòng mới từ {self.path}")
+            except Exception as e:
+                print(f"Lỗi khi nạp dữ liệu từ {self.path}: {str(e)}")
 
 # Khởi tạo hệ thống
 qa_system = CryptoQASystem("coin_historical_2020_2025.csv")
+metrics.counter_func('qa_cache_requests_total', 'Lượt tra cache kế hoạch/kết quả/chỉ số dẫn xuất', lambda: {
+    key: value
+    for name, cache in (('plan', qa_system.plan_cache), ('result', qa_system.result_cache),
+                        ('derived', qa_system.derived_cache))
+    for key, value in (((name, 'hit'), cache.hits), ((name, 'miss'), cache.misses))
+}, ['cache', 'result'])
+metrics.gauge_func('qa_rows', 'Số dòng dữ liệu đang nạp', lambda: sum(len(s) for s in qa_system.index.values()))
+metrics.gauge_func('qa_data_version', 'Phiên bản dữ liệu (tăng khi nạp lại/thêm dòng)', lambda: qa_system.version)
+
+def start_background():
+    """Tạo pool tiến trình và luồng theo dõi CSV; luồng không sống qua fork nên gọi trong tiến trình phục vụ request."""
+    if QA_PROCESSES > 0:
+        qa_system.pool = QueryPool(qa_system, QA_PROCESSES, QA_QUEUE_SIZE, QA_QUERY_TIMEOUT)
+        # Fork các tiến trình con ngay, trước khi có luồng theo dõi CSV hay luồng phục vụ request
+        qa_system.pool.start()
+    if INGEST_FILE:
+        CsvTailWatcher(qa_system, INGEST_FILE).start()
+
+if not PREFORK:
+    start_background()
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -111,5 +603,57 @@ def index():
             result = qa_system.execute_query(query)
     return render_template("index.html", columns=columns, result=result, query=query)
 
+@app.route("/stream", methods=["GET", "POST"])
+def stream_result():
+    query = request.values.get("query", "")
+    return Response(stream_with_context(qa_system.iter_listing(query)), mimetype="text/plain; charset=utf-8")
+
+@app.route("/api/rows", methods=["GET"])
+def api_rows():
+    query = request.args.get("query", "")
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_ROWS))
+        after_date_str = request.args.get("after_date")
+        after_date = parse_date_str(after_date_str) if after_date_str else None
+        if after_date_str and after_date is None:
+            raise ValueError(f"after_date không hợp lệ: {after_date_str}")
+        if not 1 <= limit <= MAX_PAGE_ROWS:
+            raise ValueError(f"limit phải nằm trong khoảng 1..{MAX_PAGE_ROWS}")
+        page = qa_system.page_rows(query, limit, request.args.get("after_coin"), after_date)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    payload = request.get_json(silent=True)
+    queries = payload.get('queries') if isinstance(payload, dict) else payload
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': 'Cần JSON dạng danh sách câu hỏi hoặc {"queries": [...]}'}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'Tối đa {MAX_BATCH_QUERIES} câu hỏi mỗi lần'}), 400
+    results = qa_system.execute_batch(queries)
+    return jsonify({'results': [{'query': q, 'result': r} for q, r in zip(queries, results)]})
+
+@app.route("/append", methods=["POST"])
+def append_data():
+    payload = request.get_json(silent=True)
+    rows = payload.get('rows') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        return jsonify({'error': 'Cần JSON dạng danh sách dòng hoặc {"rows": [...]}'}), 400
+    try:
+        return jsonify(qa_system.append_rows(rows))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Dữ liệu không hợp lệ: {str(e)}'}), 400
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    return jsonify(qa_system.cache_stats())
+
+@app.route("/reload", methods=["POST"])
+def reload_data():
+    qa_system.reload()
+    return jsonify(qa_system.cache_stats())
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""Benchmark CryptoQASystem trên dữ liệu tổng hợp từ cỡ file CSV gốc tới hàng chục triệu dòng.
+
+    python bench_qa.py --rows 27000 1000000 10000000 --queries 500 --json result.json
+    python bench_qa.py --rows 1000000 --snapshot
+
+Mỗi cỡ dữ liệu chạy trong một tiến trình con (peak RSS đo riêng). Với mỗi loại câu hỏi (ngày cụ thể,
+thống kê theo coin, thống kê theo khoảng ngày, thống kê mọi coin, liệt kê khoảng ngày, liệt kê toàn bộ
+một coin) đo thời gian từng bước parse / filter / aggregate / render khi cache rỗng, cùng tổng thời gian
+execute_query khi cache rỗng và khi cache đã có kết quả. File CSV tổng hợp được giữ trong --data-dir
+để các lần chạy sau dùng lại.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_CSV = os.path.join(HERE, 'coin_historical_2020_2025.csv')
+START_DATE = np.datetime64('2020-07-21')
+MAX_DAYS = 1826  # 5 năm dữ liệu ngày cho mỗi coin
+KINDS = ('point', 'aggregate', 'range_aggregate', 'all_coins_aggregate', 'listing', 'full_listing')
+OPERATIONS = [('Tổng', 'volume'), ('Trung bình', 'close'), ('Giá lớn nhất', 'high'), ('Giá nhỏ nhất', 'low')]
+
+
+# percentile/summarize giống hệt nhau trong bench_counter.py (Week 4), bench_qa.py (Week 5) và
+# bench_submit.py (Week 6): mỗi tuần là một thư mục chạy độc lập nên chép thay vì import; sửa thì sửa cả ba
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 4),
+        'p50_ms': round(percentile(values, 50) * 1000, 4),
+        'p95_ms': round(percentile(values, 95) * 1000, 4),
+        'p99_ms': round(percentile(values, 99) * 1000, 4),
+        'max_ms': round(values[-1] * 1000, 4),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=HERE).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def coin_names(count):
+    real = list(pd.read_csv(SOURCE_CSV, usecols=['coin'])['coin'].unique())
+    return (real + [f'C{i:06d}' for i in range(count - len(real))])[:count]
+
+
+def generate_csv(path, rows, seed):
+    """CSV cùng định dạng file gốc: mỗi coin một chuỗi ngày liên tục, giá đi theo bước ngẫu nhiên."""
+    days = min(MAX_DAYS, rows)
+    coins = coin_names(max(1, rows // days))
+    rng = np.random.default_rng(seed)
+    dates = np.datetime_as_string(START_DATE + np.arange(days), unit='D')
+    with open(path, 'w', newline='') as f:
+        f.write('coin,date,open,high,low,close,volume\n')
+        for coin in coins:
+            close = rng.uniform(0.01, 50000) * np.exp(np.cumsum(rng.normal(0, 0.03, days)))
+            open_ = np.concatenate([[close[0]], close[:-1]])
+            high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.05, days))
+            low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.05, days))
+            volume = rng.uniform(1e5, 1e10, days)
+            pd.DataFrame({'coin': coin, 'date': dates, 'open': open_, 'high': high, 'low': low,
+                          'close': close, 'volume': volume}).to_csv(f, header=False, index=False,
+                                                                    float_format='%.2f')
+    return len(coins) * days
+
+
+def dataset_path(data_dir, rows, seed):
+    return os.path.join(data_dir, f'synthetic_{rows}_{seed}.csv')
+
+
+def workload(index, count, seed):
+    """count câu hỏi mỗi loại, coin và ngày chọn ngẫu nhiên trong dữ liệu có thật."""
+    rng = random.Random(seed)
+    coins = sorted(index)
+
+    def pick_day(series, span=0):
+        i = rng.randrange(max(1, len(series.days) - span))
+        return str(series.days[i].astype('datetime64[D]')), str(series.days[min(i + span, len(series.days) - 1)].astype('datetime64[D]'))
+
+    queries = {kind: [] for kind in KINDS}
+    for _ in range(count):
+        coin = rng.choice(coins)
+        series = index[coin]
+        label, column = rng.choice(OPERATIONS)
+        day, _ = pick_day(series)
+        start, end = pick_day(series, rng.randrange(30, 365))
+        queries['point'].append(f'Giá {column} của coin {coin} nơi ngày là {day}')
+        queries['aggregate'].append(f'{label} {column} của coin {coin}')
+        queries['range_aggregate'].append(f'{label} {column} của coin {coin} từ {start} đến {end}')
+        queries['all_coins_aggregate'].append(f'{label} {column} từ {start} đến {end}')
+        start, end = pick_day(series, rng.randrange(7, 90))
+        queries['listing'].append(f'Giá {column} của coin {coin} từ {start} đến {end}')
+        queries['full_listing'].append(f'Giá {column} của coin {coin}')
+    return queries
+
+
+class StageTimer:
+    """Truyền vào CryptoQASystem._execute(stage=...) để lấy thời gian từng bước của chính đường chạy thật."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_stages(qa, query):
+    """Chạy câu hỏi qua _parse_query và _execute của app (không cache), bấm giờ từng bước."""
+    from app import NO_COLUMN_MESSAGE
+
+    timer = StageTimer()
+    with timer('parse'):
+        column, operation, condition = qa._parse_query(qa.clean_query(query))
+    if not column:
+        text = NO_COLUMN_MESSAGE
+    else:
+        text = qa._execute(column, operation, condition, qa.index, stage=timer)
+    return text, tuple(timer.seconds.get(name, 0.0) for name in ('parse', 'filter', 'aggregate', 'render'))
+
+
+def bench_kind(qa, queries):
+    stages = {'parse': [], 'filter': [], 'aggregate': [], 'render': []}
+    cold = []
+    mismatches = 0
+    for query in queries:
+        text, timings = run_stages(qa, query)
+        for name, seconds in zip(stages, timings):
+            stages[name].append(seconds)
+        qa.plan_cache.clear()
+        qa.result_cache.clear()
+        start = time.perf_counter()
+        answer = qa.execute_query(query)
+        cold.append(time.perf_counter() - start)
+        mismatches += answer != text
+    # Nạp cache kế hoạch và cache kết quả rồi đo lượt chạy lại
+    for query in queries:
+        qa.execute_query(query)
+    warm = []
+    for query in queries:
+        start = time.perf_counter()
+        qa.execute_query(query)
+        warm.append(time.perf_counter() - start)
+    return {
+        'stages': {name: summarize(values) for name, values in stages.items()},
+        'cold': summarize(cold),
+        'cold_ops_per_sec': round(len(cold) / sum(cold), 1),
+        'warm': summarize(warm),
+        'warm_ops_per_sec': round(len(warm) / sum(warm), 1),
+        'mismatches': mismatches,
+    }
+
+
+def run_child(args):
+    import app
+
+    baseline_rss = peak_rss_mb()
+    path = dataset_path(args.data_dir, args.rows[0], args.seed)
+    result = {'rows_requested': args.rows[0], 'csv_mb': round(os.path.getsize(path) / 2 ** 20, 1)}
+    stages = {}
+    app.USE_SNAPSHOT = False
+    start = time.perf_counter()
+    qa = app.CryptoQASystem(path)
+    stages['load_csv_s'] = round(time.perf_counter() - start, 3)
+    if args.snapshot:
+        app.USE_SNAPSHOT = True
+        app.SNAPSHOT_DIR = args.data_dir
+        start = time.perf_counter()
+        qa = app.CryptoQASystem(path)
+        stages['load_snapshot_first_s'] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        qa = app.CryptoQASystem(path)
+        stages['load_snapshot_s'] = round(time.perf_counter() - start, 3)
+    result['rows'] = sum(len(series) for series in qa.index.values())
+    result['coins'] = len(qa.index)
+    result['load'] = stages
+    result['rss_after_load_mb'] = peak_rss_mb()
+
+    queries = workload(qa.index, args.queries, args.seed)
+    # Dựng sẵn các sparse table để lần đo đầu không gánh chi phí dựng lười
+    qa.execute_batch([q for kind in ('aggregate', 'range_aggregate') for q in queries[kind][:1]])
+    result['kinds'] = {kind: bench_kind(qa, queries[kind]) for kind in args.kinds}
+    result['baseline_rss_mb'] = baseline_rss
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CryptoQASystem trên dữ liệu tổng hợp')
+    parser.add_argument('--rows', type=int, nargs='+', default=[27000, 1000000])
+    parser.add_argument('--queries', type=int, default=200, help='số câu hỏi mỗi loại')
+    parser.add_argument('--kinds', nargs='+', default=list(KINDS), choices=KINDS)
+    parser.add_argument('--snapshot', action='store_true', help='đo thêm thời gian nạp qua snapshot .npy')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'qa-bench'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    runs = []
+    for rows in args.rows:
+        path = dataset_path(args.data_dir, rows, args.seed)
+        generate_s = None
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            generate_csv(path + '.tmp', rows, args.seed)
+            os.replace(path + '.tmp', path)
+            generate_s = round(time.perf_counter() - start, 3)
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', '--rows', str(rows),
+               '--queries', str(args.queries), '--data-dir', args.data_dir, '--seed', str(args.seed),
+               '--kinds', *args.kinds] + (['--snapshot'] if args.snapshot else [])
+        # QA_SNAPSHOT=0: bản dữ liệu mẫu app.py nạp lúc import không cần dựng snapshot
+        env = dict(os.environ, QA_SNAPSHOT='0')
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=HERE, env=env).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['generate_s'] = generate_s
+        runs.append(run)
+        print(f"{rows} dòng: xong", file=sys.stderr)
+
+    report = {
+        'benchmark': 'crypto_qa',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'queries_per_kind': args.queries,
+        'runs': runs,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
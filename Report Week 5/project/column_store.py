@@ -0,0 +1,350 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# Mỗi CoinSeries (kể cả bản mới sau khi nối dữ liệu) có một số phiên bản riêng, không lặp lại
+_versions = itertools.count(1)
+
+
+def to_day(d):
+    """Đổi date/datetime thành số ngày kể từ 1970-01-01 (int64)."""
+    return int(np.datetime64(d, 'D').astype(np.int64))
+
+
+def day_strings(days):
+    return np.datetime_as_string(days.astype('datetime64[D]'))
+
+
+def build_sparse_table(values, fn, fill):
+    """Sparse table cho min/max: tầng j giữ kết quả của mọi đoạn dài 2**j."""
+    level = np.where(np.isnan(values), fill, values)
+    table = [level]
+    span = 1
+    while 2 * span <= len(values):
+        level = fn(level[:-span], level[span:])
+        table.append(level)
+        span *= 2
+    return table
+
+
+def build_prefix(values):
+    """Tổng tiền tố và số giá trị khác NaN tiền tố (dài n + 1) cho từng cột."""
+    prefix_sum, prefix_count = {}, {}
+    for col, arr in values.items():
+        valid = ~np.isnan(arr)
+        prefix_sum[col] = np.concatenate(([0.0], np.cumsum(np.where(valid, arr, 0.0))))
+        prefix_count[col] = np.concatenate(([0], np.cumsum(valid)))
+    return prefix_sum, prefix_count
+
+
+SPARSE_OPS = {'max': (np.maximum, -np.inf), 'min': (np.minimum, np.inf)}
+
+
+def rolling_sum(values, window):
+    """Tổng trượt của window dòng liên tiếp kết thúc tại mỗi dòng; NaN nếu cửa sổ chưa đủ hoặc có NaN."""
+    valid = ~np.isnan(values)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    ccount = np.concatenate(([0], np.cumsum(valid)))
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        full = (ccount[window:] - ccount[:-window]) == window
+        result[window - 1:] = np.where(full, csum[window:] - csum[:-window], np.nan)
+    return result
+
+
+def daily_returns(values):
+    """Lợi nhuận so với dòng trước (%)."""
+    result = np.full(len(values), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[1:] = (values[1:] / values[:-1] - 1) * 100
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def moving_average(values, window):
+    return rolling_sum(values, window) / window
+
+
+def rolling_volatility(values, window):
+    """Độ lệch chuẩn mẫu (%) của lợi nhuận ngày trong window ngày gần nhất."""
+    returns = daily_returns(values) / 100
+    mean = rolling_sum(returns, window) / window
+    squares = rolling_sum(returns * returns, window)
+    variance = (squares - window * mean * mean) / (window - 1)
+    return np.sqrt(np.maximum(variance, 0.0)) * 100
+
+
+def drawdown(values):
+    """Mức giảm (%) so với đỉnh cao nhất từ đầu dữ liệu tới ngày đó."""
+    peak = np.fmax.accumulate(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (1 - values / peak) * 100
+
+
+# Chỉ số dẫn xuất: tên -> (hàm tính trên cả chuỗi, có dùng cửa sổ hay không)
+DERIVED = {
+    'return': (lambda values, window: daily_returns(values), False),
+    'ma': (moving_average, True),
+    'volatility': (rolling_volatility, True),
+    'drawdown': (lambda values, window: drawdown(values), False),
+}
+
+
+class Growable:
+    """Vùng nhớ có dư sức chứa cho một mảng chỉ nối thêm ở cuối.
+
+    Các view [:n] đã phát ra không bao giờ bị ghi đè: chỉ chủ của view dài nhất
+    (n == length) mới được ghi tiếp vào phần dư, view cũ hơn muốn nối thì phải sao chép.
+    """
+
+    def __init__(self, data, capacity):
+        self.buf = np.empty(max(capacity, len(data), 16), dtype=data.dtype)
+        self.buf[:len(data)] = data
+        self.length = len(data)
+
+
+def append_to(growable, view, new):
+    """Nối new vào sau view, trả về (growable, view mới); khấu hao O(len(new))."""
+    n, k = len(view), len(new)
+    if growable is None or growable.length != n or n + k > len(growable.buf):
+        # Sao chép với sức chứa gấp đôi để các lần nối sau ghi thẳng vào phần dư
+        growable = Growable(view, 2 * (n + k))
+    growable.buf[n:n + k] = new
+    growable.length = n + k
+    return growable, growable.buf[:n + k]
+
+
+class CoinSeries:
+    """Dữ liệu của một coin lưu theo cột: ngày (int64, tăng dần) và các mảng giá trị float64.
+
+    Kèm theo chỉ mục tổng hợp để trả lời thống kê trên một đoạn ngày liên tiếp:
+    tổng tiền tố (sum/mean/count, O(1)) và sparse table (max/min, O(1), dựng khi cần).
+    """
+
+    def __init__(self, coin, days, values, prefix_sum=None, prefix_count=None):
+        self.coin = coin
+        self.version = next(_versions)
+        self.days = days
+        self.values = values
+        if prefix_sum is None:
+            prefix_sum, prefix_count = build_prefix(values)
+        self.prefix_sum = prefix_sum
+        self.prefix_count = prefix_count
+        self._sparse = {}
+        # Vùng nhớ dư phía sau các mảng trên (nếu có), để appended() ghi tiếp không cần sao chép
+        self._growables = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    def appended(self, days, values):
+        """CoinSeries mới có thêm các dòng đã sắp theo ngày, tất cả sau ngày cuối hiện có.
+
+        Chỉ ghi thêm vào cuối mảng (khấu hao O(số dòng mới)) nên các truy vấn đang đọc
+        bản hiện tại vẫn thấy dữ liệu nhất quán.
+        """
+        if len(self.days) and len(days) and days[0] <= self.days[-1]:
+            raise ValueError("appended() chỉ nhận các ngày sau ngày cuối hiện có")
+        growables = {}
+
+        def extend(key, view, new):
+            growables[key], result = append_to(self._growables.get(key), view, new)
+            return result
+
+        new_values, prefix_sum, prefix_count = {}, {}, {}
+        for col, arr in self.values.items():
+            new = np.asarray(values[col], dtype=np.float64)
+            valid = ~np.isnan(new)
+            new_values[col] = extend(('value', col), arr, new)
+            psum, pcount = self.prefix_sum[col], self.prefix_count[col]
+            prefix_sum[col] = extend(('prefix_sum', col), psum, psum[-1] + np.cumsum(np.where(valid, new, 0.0)))
+            prefix_count[col] = extend(('prefix_count', col), pcount, pcount[-1] + np.cumsum(valid))
+        series = CoinSeries(self.coin, extend('days', self.days, np.asarray(days, dtype=np.int64)),
+                            new_values, prefix_sum, prefix_count)
+
+        # Sparse table đã dựng: chỉ tính các ô mới phủ tới dòng mới ở mỗi tầng
+        n_new = len(series)
+        for (col, op), table in list(self._sparse.items()):
+            fn, fill = SPARSE_OPS[op]
+            new_values_col = series.values[col][len(self):]
+            levels = [extend(('sparse', col, op, 0), table[0], np.where(np.isnan(new_values_col), fill, new_values_col))]
+            span = 1
+            while 2 * span <= n_new:
+                prev = levels[-1]
+                j = len(levels)
+                old = table[j] if j < len(table) else prev[:0]
+                start, stop = len(old), n_new - 2 * span + 1
+                levels.append(extend(('sparse', col, op, j), old,
+                                     fn(prev[start:stop], prev[start + span:stop + span])))
+                span *= 2
+            series._sparse[(col, op)] = levels
+        series._growables = growables
+        return series
+
+    def derived(self, metric, window, column):
+        """CoinSeries chứa chỉ số dẫn xuất của cột (lưu dưới cùng tên cột), bỏ các ngày đầu chưa đủ cửa sổ.
+
+        Tính O(n) trên cả chuỗi; kết quả có tổng tiền tố và sparse table riêng nên thống kê trên khoảng
+        ngày vẫn O(1). Việc giữ lại để dùng lại do người gọi quyết định (CryptoQASystem.derived_cache).
+        """
+        fn, _ = DERIVED[metric]
+        values = fn(self.values[column], window)
+        valid = ~np.isnan(values)
+        start = int(np.argmax(valid)) if valid.any() else len(values)
+        return CoinSeries(self.coin, self.days[start:], {column: values[start:]})
+
+    def sparse_table(self, column, operation):
+        key = (column, operation)
+        table = self._sparse.get(key)
+        if table is None:
+            fn, fill = SPARSE_OPS[operation]
+            table = self._sparse[key] = build_sparse_table(self.values[column], fn, fill)
+        return table
+
+    def range_stat(self, column, operation, lo, hi):
+        """Giá trị trung gian của phép thống kê trên đoạn [lo, hi), dùng cho combine()."""
+        if operation in ('sum', 'count', 'mean'):
+            total = self.prefix_sum[column][hi] - self.prefix_sum[column][lo]
+            count = int(self.prefix_count[column][hi] - self.prefix_count[column][lo])
+            return {'sum': total, 'count': count, 'mean': (total, count)}[operation]
+        if operation in SPARSE_OPS:
+            table = self.sparse_table(column, operation)
+            j = (hi - lo).bit_length() - 1
+            fn, _ = SPARSE_OPS[operation]
+            return float(fn(table[j][lo], table[j][hi - (1 << j)]))
+        raise ValueError(f"Phép tính không hỗ trợ: {operation}")
+
+    def range_stats(self, column, operation, lo, hi):
+        """Phiên bản vector hóa của range_stat(): lo, hi là mảng chỉ số, mỗi cặp một đoạn.
+
+        Đoạn rỗng cho 0 (sum/count) hoặc giá trị lấp ±inf (max/min) để combine_many() bỏ qua.
+        """
+        if operation in ('sum', 'count', 'mean'):
+            total = self.prefix_sum[column][hi] - self.prefix_sum[column][lo]
+            count = self.prefix_count[column][hi] - self.prefix_count[column][lo]
+            return {'sum': total, 'count': count, 'mean': (total, count)}[operation]
+        if operation in SPARSE_OPS:
+            fn, fill = SPARSE_OPS[operation]
+            table = self.sparse_table(column, operation)
+            length = hi - lo
+            result = np.full(len(lo), fill)
+            levels = np.zeros(len(lo), dtype=np.int64)
+            nonempty = length > 0
+            levels[nonempty] = np.floor(np.log2(length[nonempty])).astype(np.int64)
+            # Gom các đoạn cùng tầng j để đọc sparse table một lần cho mỗi tầng
+            for j in np.unique(levels[nonempty]):
+                mask = nonempty & (levels == j)
+                result[mask] = fn(table[j][lo[mask]], table[j][hi[mask] - (1 << int(j))])
+            return result
+        raise ValueError(f"Phép tính không hỗ trợ: {operation}")
+
+    def date_ranges(self, start_days, end_days):
+        """Phiên bản vector hóa của date_range() cho mảng ngày đầu/cuối."""
+        lo = np.searchsorted(self.days, start_days, 'left')
+        hi = np.searchsorted(self.days, end_days, 'right')
+        return lo, np.maximum(lo, hi)
+
+    def date_range(self, start_day=None, end_day=None):
+        """Khoảng chỉ số [lo, hi) của các dòng có ngày nằm trong [start_day, end_day]."""
+        lo = 0 if start_day is None else int(np.searchsorted(self.days, start_day, 'left'))
+        hi = len(self.days) if end_day is None else int(np.searchsorted(self.days, end_day, 'right'))
+        return lo, max(lo, hi)
+
+
+def sort_columns(df):
+    """Sắp xếp toàn bộ dữ liệu một lần theo (coin, ngày) vào các mảng liền nhau.
+
+    Trả về danh sách coin, biên đoạn của từng coin (coin i nằm ở [bounds[i], bounds[i+1]))
+    và các mảng ngày/giá trị đã sắp xếp.
+    """
+    codes, coins = pd.factorize(df['coin'].str.upper())
+    days = df['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    order = np.lexsort((days, codes))
+    codes = codes[order]
+    days = np.ascontiguousarray(days[order])
+    values = {col: np.ascontiguousarray(df[col].to_numpy(dtype=np.float64)[order]) for col in COLUMNS}
+    bounds = np.searchsorted(codes, np.arange(len(coins) + 1))
+    return list(coins), bounds, days, values
+
+
+def index_from_arrays(coins, bounds, days, values, prefix_sum=None, prefix_count=None):
+    """Tạo coin -> CoinSeries; mỗi CoinSeries chỉ giữ view (không copy) trên đoạn của coin đó.
+
+    prefix_sum/prefix_count (nếu có) là mảng tiền tố của các coin nối nhau,
+    mỗi coin chiếm n_i + 1 phần tử, bắt đầu tại bounds[i] + i.
+    """
+    index = {}
+    for i, coin in enumerate(coins):
+        lo, hi = int(bounds[i]), int(bounds[i + 1])
+        series_values = {col: arr[lo:hi] for col, arr in values.items()}
+        if prefix_sum is None:
+            index[coin] = CoinSeries(coin, days[lo:hi], series_values)
+        else:
+            plo, phi = lo + i, hi + i + 1
+            index[coin] = CoinSeries(coin, days[lo:hi], series_values,
+                                     {col: arr[plo:phi] for col, arr in prefix_sum.items()},
+                                     {col: arr[plo:phi] for col, arr in prefix_count.items()})
+    return index
+
+
+def build_index(df):
+    """Chia DataFrame theo coin thành các CoinSeries nằm liền nhau trong bộ nhớ."""
+    return index_from_arrays(*sort_columns(df))
+
+
+def merge_rows(series, coin, days, values):
+    """Ghép các dòng mới (đã sắp theo ngày, không trùng ngày) vào series, trả về CoinSeries mới.
+
+    Dòng mới nằm sau ngày cuối thì chỉ nối thêm; nếu có dòng sửa/chèn vào giữa lịch sử
+    thì dựng lại coin đó (O(n)), dòng mới thắng khi trùng ngày.
+    """
+    if series is None:
+        return CoinSeries(coin, np.array(days, dtype=np.int64),
+                          {col: np.array(values[col], dtype=np.float64) for col in COLUMNS})
+    if not len(series) or days[0] > series.days[-1]:
+        return series.appended(days, values)
+    keep = ~np.isin(series.days, days)
+    merged_days = np.concatenate((series.days[keep], days))
+    order = np.argsort(merged_days, kind='stable')
+    merged = {col: np.concatenate((series.values[col][keep], np.asarray(values[col], dtype=np.float64)))[order]
+              for col in COLUMNS}
+    return CoinSeries(coin, merged_days[order], merged)
+
+
+def combine(partials, operation):
+    """Gộp kết quả range_stat() của nhiều coin/đoạn thành kết quả cuối."""
+    if operation == 'sum':
+        return float(sum(partials))
+    if operation == 'count':
+        return int(sum(partials))
+    if operation == 'mean':
+        total = sum(p[0] for p in partials)
+        count = sum(p[1] for p in partials)
+        return float(total / count) if count else float('nan')
+    if operation in SPARSE_OPS:
+        fn, fill = SPARSE_OPS[operation]
+        result = float(fn.reduce(partials)) if partials else fill
+        # Toàn NaN thì sparse table trả về giá trị lấp (±inf)
+        return float('nan') if result == fill else result
+    raise ValueError(f"Phép tính không hỗ trợ: {operation}")
+
+
+def combine_many(partials, operation, size):
+    """Phiên bản vector hóa của combine(): gộp range_stats() của nhiều coin, mỗi phần tử một câu hỏi."""
+    if not partials:
+        return np.full(size, np.nan)
+    if operation in ('sum', 'count'):
+        return np.sum(partials, axis=0).astype(np.float64)
+    if operation == 'mean':
+        total = np.sum([p[0] for p in partials], axis=0)
+        count = np.sum([p[1] for p in partials], axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    if operation in SPARSE_OPS:
+        fn, fill = SPARSE_OPS[operation]
+        result = fn.reduce(np.asarray(partials, dtype=np.float64), axis=0)
+        return np.where(result == fill, np.nan, result)
+    raise ValueError(f"Phép tính không hỗ trợ: {operation}")
@@ -0,0 +1,37 @@
+"""Chạy production nhiều tiến trình:
+
+    gunicorn -c gunicorn.conf.py
+
+Tiến trình master nạp dữ liệu một lần (preload_app) rồi fork các worker; mảng NumPy được dùng chung
+copy-on-write (snapshot .npy đọc bằng memory-map thì dùng chung qua page cache), nên tổng bộ nhớ
+gần bằng một bản dữ liệu dù có nhiều worker.
+"""
+import gc
+import multiprocessing
+import os
+
+# app.py không tự tạo luồng nền/pool lúc import trong master, post_fork tạo cho từng worker
+os.environ['QA_PREFORK'] = '1'
+
+wsgi_app = 'app:app'
+bind = os.getenv('QA_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('QA_WORKERS', multiprocessing.cpu_count()))
+# Mỗi worker phục vụ vài request cùng lúc; câu hỏi nặng được đẩy sang pool tiến trình (QA_PROCESSES)
+worker_class = 'gthread'
+threads = int(os.getenv('QA_THREADS', '4'))
+preload_app = True
+timeout = int(os.getenv('QA_WORKER_TIMEOUT', '60'))
+graceful_timeout = 30
+# Khởi động lại worker định kỳ để giải phóng bộ nhớ bị copy dần (cache, trang dữ liệu bị ghi)
+max_requests = int(os.getenv('QA_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+
+def pre_fork(server, worker):
+    # Đưa các object đã nạp ra khỏi tầm GC để GC của worker không ghi vào (và copy) các trang nhớ dùng chung
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background()
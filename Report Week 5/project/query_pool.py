@@ -0,0 +1,95 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Đối tượng CryptoQASystem mà tiến trình con nhận được khi fork (dùng chung trang nhớ copy-on-write)
+_qa = None
+
+
+class PoolBusy(RuntimeError):
+    pass
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+def _execute(column, operation, condition):
+    # Chạy trong tiến trình con: chỉ đọc chỉ mục, không đo thời gian (histogram có khóa) và không đụng
+    # tới cache/khóa của tiến trình cha. Khóa mà luồng khác giữ lúc fork không bao giờ được nhả trong
+    # tiến trình con, nên đường chạy ở đây phải không lấy khóa nào
+    return _qa._execute(column, operation, condition, _qa.index, in_pool=True)
+
+
+class QueryPool:
+    """Chạy câu hỏi nặng (liệt kê, thống kê mọi coin) trong các tiến trình con fork từ tiến trình hiện tại.
+
+    Tối đa queue_size câu hỏi chờ/chạy cùng lúc, quá thì raise PoolBusy; chờ quá timeout giây thì
+    raise PoolTimeout và pool bị dựng lại (tiến trình con đang treo bị dừng). Khi dữ liệu đổi phiên bản
+    (append/reload), pool được fork lại để tiến trình con thấy dữ liệu mới. Gọi start() trước khi có
+    luồng phục vụ request để lần fork đầu xảy ra khi tiến trình còn một luồng.
+    """
+
+    def __init__(self, qa_system, processes, queue_size=16, timeout=30):
+        self.qa_system = qa_system
+        self.processes = processes
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._version = None
+
+    def _pool(self):
+        global _qa
+        with self._lock:
+            if self._executor is None or self._version != self.qa_system.version:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                _qa = self.qa_system
+                self._version = self.qa_system.version
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('fork'))
+            return self._executor
+
+    def start(self):
+        # Với fork, ProcessPoolExecutor tạo đủ mọi tiến trình con ở lần submit đầu tiên
+        self._pool().submit(int).result()
+
+    def _recycle(self, executor):
+        """Bỏ executor có tiến trình con treo: dừng các tiến trình con, lần gọi sau fork pool mới."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        processes = list(executor._processes.values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Các future còn lại nhận BrokenProcessPool, done callback trả lại chỗ trong hàng đợi
+        for process in processes:
+            process.terminate()
+
+    def execute(self, column, operation, condition):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy("Hệ thống đang bận, vui lòng thử lại sau.")
+        try:
+            executor = self._pool()
+            future = executor.submit(_execute, column, operation, condition)
+        except Exception:
+            self._slots.release()
+            raise
+        # Giải phóng chỗ khi tiến trình con xong hoặc bị dừng
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            self._recycle(executor)
+            raise PoolTimeout(f"Câu hỏi chạy quá {self.timeout:g} giây.")
+        except BrokenProcessPool:
+            # Pool bị dựng lại do câu hỏi khác quá thời gian
+            self._recycle(executor)
+            raise PoolBusy("Hệ thống đang bận, vui lòng thử lại sau.")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,138 @@
+"""Snapshot nhị phân theo cột của file CSV giá coin.
+
+Lần đầu (hoặc khi CSV thay đổi) dữ liệu được đọc bằng pandas, sắp xếp theo
+(coin, ngày) rồi ghi mỗi cột ra một file .npy. Các lần khởi động sau chỉ cần
+np.load(mmap_mode='r'): không parse CSV, và các worker fork từ cùng máy dùng
+chung trang bộ nhớ của file qua page cache của hệ điều hành.
+
+Dựng snapshot trước khi deploy:
+    python snapshot.py coin_historical_2020_2025.csv
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from column_store import COLUMNS, sort_columns, build_prefix, index_from_arrays
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def default_snapshot_dir(csv_file):
+    return os.path.splitext(csv_file)[0] + '.snapshot'
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_info(csv_file):
+    st = os.stat(csv_file)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _save_array(snapshot_dir, name, arr):
+    # Ghi ra file tạm rồi os.replace để tiến trình khác không bao giờ đọc phải file ghi dở
+    path = os.path.join(snapshot_dir, name + '.npy')
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _write_manifest(snapshot_dir, manifest):
+    path = os.path.join(snapshot_dir, MANIFEST)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def build_snapshot(csv_file, snapshot_dir=None):
+    snapshot_dir = snapshot_dir or default_snapshot_dir(csv_file)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    df = pd.read_csv(csv_file)
+    df['date'] = pd.to_datetime(df['date'])
+    coins, bounds, days, values = sort_columns(df)
+
+    _save_array(snapshot_dir, 'days', days)
+    for col, arr in values.items():
+        _save_array(snapshot_dir, col, arr)
+        # Mảng tiền tố của các coin nối nhau, mỗi coin n_i + 1 phần tử
+        parts = [build_prefix({col: arr[bounds[i]:bounds[i + 1]]}) for i in range(len(coins))]
+        _save_array(snapshot_dir, f'prefix_sum_{col}', np.concatenate([p[0][col] for p in parts]))
+        _save_array(snapshot_dir, f'prefix_count_{col}', np.concatenate([p[1][col] for p in parts]))
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'source': dict(_source_info(csv_file), sha256=file_sha256(csv_file)),
+        'columns': list(df.columns.str.lower()),
+        'coins': coins,
+        'bounds': [int(b) for b in bounds],
+    }
+    # Manifest ghi sau cùng: có manifest nghĩa là các file .npy đã đầy đủ
+    _write_manifest(snapshot_dir, manifest)
+    return manifest
+
+
+def read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == FORMAT_VERSION else None
+
+
+def is_fresh(manifest, csv_file):
+    """Snapshot còn dùng được nếu CSV giữ nguyên kích thước + mtime, hoặc nội dung (sha256) không đổi."""
+    if manifest is None:
+        return False
+    source = manifest['source']
+    if _source_info(csv_file) == {'size': source['size'], 'mtime_ns': source['mtime_ns']}:
+        return True
+    return file_sha256(csv_file) == source['sha256']
+
+
+def load_snapshot(snapshot_dir, manifest=None):
+    """Nạp snapshot dạng memory-map, trả về (columns, index coin -> CoinSeries)."""
+    manifest = manifest or read_manifest(snapshot_dir)
+
+    def load(name):
+        return np.load(os.path.join(snapshot_dir, name + '.npy'), mmap_mode='r')
+
+    days = load('days')
+    values = {col: load(col) for col in COLUMNS}
+    prefix_sum = {col: load(f'prefix_sum_{col}') for col in COLUMNS}
+    prefix_count = {col: load(f'prefix_count_{col}') for col in COLUMNS}
+    index = index_from_arrays(manifest['coins'], manifest['bounds'], days, values, prefix_sum, prefix_count)
+    return manifest['columns'], index
+
+
+def open_snapshot(csv_file, snapshot_dir=None):
+    """Nạp snapshot của csv_file, dựng lại trước nếu chưa có hoặc CSV đã thay đổi."""
+    snapshot_dir = snapshot_dir or default_snapshot_dir(csv_file)
+    manifest = read_manifest(snapshot_dir)
+    if not is_fresh(manifest, csv_file):
+        manifest = build_snapshot(csv_file, snapshot_dir)
+    elif _source_info(csv_file) != {k: manifest['source'][k] for k in ('size', 'mtime_ns')}:
+        # Chỉ mtime đổi (vd. touch/copy lại file): cập nhật manifest để lần sau khỏi băm lại
+        manifest['source'].update(_source_info(csv_file))
+        _write_manifest(snapshot_dir, manifest)
+    return load_snapshot(snapshot_dir, manifest)
+
+
+if __name__ == '__main__':
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else 'coin_historical_2020_2025.csv'
+    snapshot_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    manifest = build_snapshot(csv_file, snapshot_dir)
+    print(f"Đã dựng snapshot cho {len(manifest['coins'])} coin, {manifest['bounds'][-1]} dòng "
+          f"tại {snapshot_dir or default_snapshot_dir(csv_file)}")
@@ -1,14 +1,20 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, jsonify, url_for
 import requests
 import os
 from dotenv import load_dotenv
 import re
 import json
-import random
 import time
-import string
+import threading
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from http_client import HttpClient, RetryPolicy, RETRY_STATUSES
+from ohlcv_cache import OhlcvCache, CacheMiss
+import metrics
 
 app = Flask(__name__)
+metrics.instrument_app(app)
 
 # Load environment variables
 load_dotenv()
@@ -17,10 +23,34 @@ CRYPTOCOMPARE_API_KEY = os.getenv('CRYPTOCOMPARE_API_KEY')
 N8N_API_KEY = os.getenv('N8N_API_KEY')
 N8N_HOST = 'n8n'
 N8N_PORT = '5678'
-N8N_BASE_URL = f'http://{N8N_HOST}:{N8N_PORT}'
+# Có thể trỏ sang máy chủ giả lập (fake_n8n.py) khi đo hiệu năng
+N8N_BASE_URL = os.getenv('N8N_BASE_URL', f'http://{N8N_HOST}:{N8N_PORT}')
+CRYPTOCOMPARE_URL = os.getenv('CRYPTOCOMPARE_URL', 'https://min-api.cryptocompare.com')
 N8N_WORKFLOWS_URL = f'{N8N_BASE_URL}/api/v1/workflows'
 N8N_RUN_URL = f'{N8N_BASE_URL}/rest/workflows'
 N8N_EXECUTIONS_URL = f'{N8N_BASE_URL}/api/v1/executions'
+ACTIVATION_CHECKS = 10
+WEBHOOK_ATTEMPTS = 5
+EXECUTION_CHECKS = 10
+# Chờ giữa các lần thử: BACKOFF_BASE, gấp đôi mỗi lần, tối đa BACKOFF_CAP giây (có jitter)
+BACKOFF_BASE = float(os.getenv('BACKOFF_BASE', '0.5'))
+BACKOFF_CAP = float(os.getenv('BACKOFF_CAP', '8'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '64'))
+# Số truy vấn chạy đồng thời và thời gian giữ kết quả job đã xong
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '32'))
+JOB_TTL = float(os.getenv('JOB_TTL', '600'))
+# Tối đa JOB_MAX_PENDING job chờ/chạy cùng lúc, vượt quá thì /submit trả 503 kèm Retry-After;
+# job đã xong giữ tối đa JOB_MAX_TRACKED cái (bỏ cái cũ nhất trước khi hết JOB_TTL)
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '256'))
+JOB_MAX_TRACKED = int(os.getenv('JOB_MAX_TRACKED', '10000'))
+JOB_RETRY_AFTER = int(os.getenv('JOB_RETRY_AFTER', '2'))
+MAX_RESULT_WAIT = 30
+# Cache nến ngày cục bộ: tính avg/max tại chỗ, chỉ gọi CryptoCompare/n8n khi thiếu dữ liệu
+OHLCV_CACHE = os.getenv('OHLCV_CACHE', 'on') == 'on'
+OHLCV_DB = os.getenv('OHLCV_DB', 'ohlcv.db')
+OHLCV_REFRESH = float(os.getenv('OHLCV_REFRESH', '300'))
+# Giữ kết quả của truy vấn giống nhau trong RESULT_TTL giây (0 = chỉ gộp các truy vấn đang chạy)
+RESULT_TTL = float(os.getenv('RESULT_TTL', '60'))
 
 def parse_query(query):
     pattern = r'(avg|average|trung bình|max|tối đa|lớn nhất)\s+(close price|giá đóng cửa|giá close|price|giá|volume|khối lượng)\s+(lớn nhất)?\s*(của)?\s*(\w+)\s*(in\s+\w+|từ\s+\d+\s+đến\s+nay)?'
@@ -64,41 +94,79 @@ def parse_query(query):
         'timeframe': '2y'
     }
 
-def generate_workflow_json(query):
-    parsed = parse_query(query)
-    random_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-    
+TIMEFRAME_LIMITS = {
+    'từ 2022 đến nay': 365 * 3,
+    'từ 2023 đến nay': 365 * 2,
+    'từ 2024 đến nay': 365,
+    '1y': 365,
+    '2y': 365 * 2,
+    '3y': 365 * 3
+}
+
+N8N_HEADERS = {
+    'X-N8N-API-KEY': N8N_API_KEY,
+    'Content-Type': 'application/json'
+}
+
+# Mọi lời gọi HTTP đi qua một session dùng chung (keep-alive, timeout và thử lại theo endpoint)
+http = HttpClient(pool_size=HTTP_POOL_SIZE)
+# Webhook: thử lại khi lỗi kết nối/5xx; POLL: nhịp chờ khi hỏi trạng thái activation/execution
+WEBHOOK_RETRY = RetryPolicy(WEBHOOK_ATTEMPTS, BACKOFF_BASE, BACKOFF_CAP)
+WEBHOOK_RETRY_NOT_FOUND = RetryPolicy(WEBHOOK_ATTEMPTS, BACKOFF_BASE, BACKOFF_CAP, RETRY_STATUSES | {404})
+POLL = RetryPolicy(base=BACKOFF_BASE, cap=BACKOFF_CAP)
+
+STAGE_SECONDS = metrics.histogram('query_stage_seconds', 'Thời gian từng bước trả lời truy vấn', ['stage'])
+ANSWER_TOTAL = metrics.counter('query_answer_total', 'Số truy vấn được trả lời theo nguồn', ['source'])
+FALLBACK_TOTAL = metrics.counter('query_fallback_total', 'Số lần phải chuyển sang cách dự phòng', ['step'])
+JOB_SECONDS = metrics.histogram('job_seconds', 'Thời gian job chờ trong hàng đợi và chạy', ['phase'])
+JOB_TOTAL = metrics.counter('job_total', 'Số job đã xong theo trạng thái', ['status'])
+JOB_REJECTED = metrics.counter('job_rejected_total', 'Số truy vấn bị từ chối vì hàng đợi job đầy')
+
+ohlcv = OhlcvCache(OHLCV_DB, http, CRYPTOCOMPARE_API_KEY, OHLCV_REFRESH,
+                   url=f'{CRYPTOCOMPARE_URL}/data/histoday') if OHLCV_CACHE else None
+
+def workflow_shape(parsed):
+    """(metric, field CryptoCompare) của câu truy vấn: mỗi shape dùng chung một workflow."""
     field = parsed['field'].replace('close price', 'close').replace('volume', 'volumeto')
-    
-    timeframe_mapping = {
-        'từ 2022 đến nay': 365 * 3,
-        'từ 2023 đến nay': 365 * 2,
-        'từ 2024 đến nay': 365,
-        '1y': 365,
-        '2y': 365 * 2,
-        '3y': 365 * 3
+    return parsed['metric'], field
+
+def webhook_params(parsed):
+    return {
+        'symbol': parsed['symbol'],
+        'currency': parsed['currency'].upper(),
+        'limit': TIMEFRAME_LIMITS.get(parsed['timeframe'], 365)
     }
-    limit = timeframe_mapping.get(parsed['timeframe'], 365)
-    
+
+# Các dạng truy vấn có workflow đăng ký sẵn lúc khởi động
+WORKFLOW_SHAPES = [(metric, field) for metric in ('avg', 'max') for field in ('close', 'volumeto')]
+REGISTRY_PREFIX = 'crypto_registry_'
+# Số workflow mỗi trang khi đọc danh sách từ n8n API (phân trang bằng nextCursor)
+WORKFLOW_PAGE_SIZE = 100
+
+def generate_workflow_json(metric, field):
+    # Workflow có tham số: symbol/currency/limit lấy từ query string của webhook
+    name = f"{REGISTRY_PREFIX}{metric}_{field}"
+    path = f"crypto/{metric}-{field}"
     workflow = {
-        "name": f"crypto_workflow_{random_id}",
+        "name": name,
         "nodes": [
             {
                 "parameters": {
                     "httpMethod": "GET",
-                    "path": f"crypto/{random_id}",
+                    "path": path,
                     "options": {},
-                    "responseMode": "onReceived",
+                    "responseMode": "lastNode",
                     "authentication": "none"
                 },
                 "name": "Webhook",
                 "type": "n8n-nodes-base.webhook",
                 "typeVersion": 1,
-                "position": [100, 300]
+                "position": [100, 300],
+                "webhookId": f"{metric}-{field}"
             },
             {
                 "parameters": {
-                    "url": f"https://min-api.cryptocompare.com/data/histoday?fsym={parsed['symbol']}&tsym={parsed['currency']}&limit={limit}&api_key={CRYPTOCOMPARE_API_KEY}",
+                    "url": f"={CRYPTOCOMPARE_URL}/data/histoday" + "?fsym={{$json[\"query\"][\"symbol\"]}}&tsym={{$json[\"query\"][\"currency\"]}}&limit={{$json[\"query\"][\"limit\"]}}" + f"&api_key={CRYPTOCOMPARE_API_KEY}",
                     "options": {}
                 },
                 "name": "CryptoCompare",
@@ -121,8 +189,8 @@ const values = data.map(item => item['{field}']);
 if (!values.every(val => typeof val === 'number')) {{
     throw new Error("Invalid {field} prices in data");
 }}
-const result = '{parsed['metric']}' === "avg" ? values.reduce((a, b) => a + b, 0) / values.length : Math.max(...values);
-return [{{ json: {{ result }} }}]];
+const result = '{metric}' === "avg" ? values.reduce((a, b) => a + b, 0) / values.length : Math.max(...values);
+return [{{ json: {{ result }} }}];
 """
                 },
                 "name": "Calculate",
@@ -146,195 +214,468 @@ return [{{ json: {{ result }} }}]];
             "saveManualExecutions": True
         }
     }
-    return workflow, random_id
+    # Tên và webhook path gắn mã băm của định nghĩa (gồm URL/API key CryptoCompare): đổi cấu hình thì
+    # tạo workflow mới thay vì dùng lại bản cũ theo tên
+    digest = hashlib.sha1(json.dumps(workflow, sort_keys=True).encode()).hexdigest()[:10]
+    path = f"{path}/{digest}"
+    workflow['name'] = f"{name}_{digest}"
+    workflow['nodes'][0]['parameters']['path'] = path
+    workflow['nodes'][0]['webhookId'] = f"{metric}-{field}-{digest}"
+    return workflow, path
+
+class WorkflowError(Exception):
+    pass
+
+def list_workflows():
+    """Mọi workflow trên n8n, đọc hết các trang theo nextCursor."""
+    params = {'limit': WORKFLOW_PAGE_SIZE}
+    while True:
+        response = http.get(N8N_WORKFLOWS_URL, 'workflows.list', headers=N8N_HEADERS, params=params)
+        if response.status_code != 200:
+            raise WorkflowError(f'Không thể lấy danh sách workflow: {response.text[:1000]}')
+        body = response.json()
+        yield from body.get('data', [])
+        if not body.get('nextCursor'):
+            return
+        params = {'limit': WORKFLOW_PAGE_SIZE, 'cursor': body['nextCursor']}
 
 def delete_old_workflows():
-    headers = {
-        'X-N8N-API-KEY': N8N_API_KEY,
-        'Content-Type': 'application/json'
-    }
+    # Dọn các workflow tạo theo từng câu truy vấn của phiên bản cũ (crypto_workflow_*) và workflow
+    # registry có định nghĩa cũ (đổi API key/URL/mã node)
+    current = {generate_workflow_json(metric, field)[0]['name'] for metric, field in WORKFLOW_SHAPES}
     try:
-        response = requests.get(N8N_WORKFLOWS_URL, headers=headers, timeout=30)
-        print(f"Phản hồi lấy danh sách workflows: {response.status_code} - {response.text[:1000]}")
-        if response.status_code == 200:
-            workflows = response.json().get('data', [])
-            for workflow in workflows:
-                if workflow.get('name').startswith('crypto_workflow_'):
-                    response = requests.delete(f"{N8N_WORKFLOWS_URL}/{workflow['id']}", headers=headers, timeout=30)
-                    print(f"Đã xóa workflow: {workflow['id']} - Status: {response.status_code}")
-    except requests.exceptions.RequestException as e:
+        # Đọc hết danh sách trước khi xóa để việc xóa không làm lệch con trỏ phân trang
+        stale = [workflow for workflow in list_workflows()
+                 if workflow.get('name', '').startswith('crypto_workflow_')
+                 or (workflow.get('name', '').startswith(REGISTRY_PREFIX) and workflow['name'] not in current)]
+        for workflow in stale:
+            response = http.delete(f"{N8N_WORKFLOWS_URL}/{workflow['id']}", 'workflows.delete', headers=N8N_HEADERS)
+            print(f"Đã xóa workflow: {workflow['id']} - Status: {response.status_code}")
+    except (WorkflowError, requests.exceptions.RequestException) as e:
         print(f"Lỗi khi xóa workflows cũ: {str(e)}")
 
+class WorkflowRegistry:
+    """Mỗi (metric, field) có một workflow n8n đăng ký và kích hoạt một lần, dùng lại cho mọi truy vấn."""
+
+    def __init__(self):
+        self._workflows = {}  # (metric, field) -> {'id': ..., 'path': ...}
+        self._lock = threading.Lock()
+        # Khóa riêng cho từng (metric, field): đăng ký một dạng không chặn truy vấn của dạng khác
+        self._shape_locks = {}
+
+    def _shape_lock(self, key):
+        with self._lock:
+            return self._shape_locks.setdefault(key, threading.Lock())
+
+    def get(self, metric, field):
+        entry = self._workflows.get((metric, field))
+        if entry:
+            return entry
+        with self._shape_lock((metric, field)):
+            entry = self._workflows.get((metric, field))
+            if not entry:
+                entry = self._workflows[(metric, field)] = self._register(metric, field)
+            return entry
+
+    def invalidate(self, metric, field):
+        with self._shape_lock((metric, field)):
+            self._workflows.pop((metric, field), None)
+
+    def _find_existing(self, name):
+        for workflow in list_workflows():
+            if workflow.get('name') == name:
+                return workflow
+        return None
+
+    def _register(self, metric, field):
+        workflow_json, path = generate_workflow_json(metric, field)
+        existing = self._find_existing(workflow_json['name'])
+        if existing:
+            workflow_id = existing['id']
+            print(f"Dùng lại workflow {workflow_json['name']} (ID: {workflow_id})")
+            if existing.get('active'):
+                return {'id': workflow_id, 'path': path}
+        else:
+            print(f"Đang tạo workflow {workflow_json['name']}...")
+            response = http.post(N8N_WORKFLOWS_URL, 'workflows.create', headers=N8N_HEADERS, json=workflow_json)
+            if response.status_code != 200:
+                raise WorkflowError(f'Không thể tạo workflow: {response.text[:1000]}')
+            workflow_id = response.json().get('id')
+            if not workflow_id:
+                raise WorkflowError('Không tìm thấy workflow_id')
+
+        print(f"Đang kích hoạt workflow {workflow_id}...")
+        response = http.post(f"{N8N_WORKFLOWS_URL}/{workflow_id}/activate", 'workflows.activate', headers=N8N_HEADERS)
+        if response.status_code != 200:
+            raise WorkflowError(f'Không thể kích hoạt workflow: {response.text[:1000]}')
+        # n8n đăng ký production webhook ngay khi kích hoạt, chỉ cần xác nhận trạng thái active
+        for attempt in range(ACTIVATION_CHECKS):
+            response = http.get(f"{N8N_WORKFLOWS_URL}/{workflow_id}", 'workflows.get', headers=N8N_HEADERS)
+            if response.status_code == 200 and response.json().get('active'):
+                print(f"Workflow {workflow_id} đã được kích hoạt!")
+                return {'id': workflow_id, 'path': path}
+            if attempt + 1 < ACTIVATION_CHECKS:
+                POLL.sleep(attempt, 'activation')
+        raise WorkflowError(f'Workflow không thể kích hoạt sau {ACTIVATION_CHECKS} lần thử')
+
+    def register_all(self):
+        for metric, field in WORKFLOW_SHAPES:
+            try:
+                self.get(metric, field)
+            except (WorkflowError, requests.exceptions.RequestException, ValueError) as e:
+                print(f"Chưa đăng ký được workflow {metric}/{field}: {str(e)}")
+
+registry = WorkflowRegistry()
+
+def warm_up():
+    delete_old_workflows()
+    registry.register_all()
+
+def extract_result(payload):
+    # Webhook responseMode=lastNode trả {"result": ...}; bản cũ trả [{"json": {"result": ...}}]
+    if isinstance(payload, list):
+        payload = payload[0]
+    if 'json' in payload:
+        payload = payload['json']
+    return payload['result']
+
+def call_webhook(url, params, endpoint, retry_not_found=False):
+    # 404: webhook chưa được đăng ký, thử lại cũng vô ích cho tới khi đăng ký lại workflow
+    retry = WEBHOOK_RETRY_NOT_FOUND if retry_not_found else WEBHOOK_RETRY
+    try:
+        return http.get(url, endpoint, params=params, retry=retry)
+    except requests.exceptions.RequestException:
+        return None
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+class QueryError(Exception):
+    pass
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Các truy vấn cùng khóa đang chạy dùng chung một lần tính; kết quả thành công được giữ ttl giây."""
+
+    def __init__(self, ttl=RESULT_TTL):
+        self.ttl = ttl
+        self._flights = {}  # khóa -> Flight đang chạy
+        self._results = {}  # khóa -> (hết hạn lúc, kết quả)
+        self._lock = threading.Lock()
+        self.hits = self.shared = self.misses = 0
+
+    def do(self, key, fn):
+        now = time.time()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > now:
+                self.hits += 1
+                return cached[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and self.ttl > 0:
+                    self._purge(now)
+                    self._results[key] = (time.time() + self.ttl, flight.result)
+            flight.done.set()
+        return flight.result
+
+    def _purge(self, now):
+        expired = [key for key, (expires, _) in self._results.items() if expires <= now]
+        for key in expired:
+            del self._results[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'shared': self.shared, 'misses': self.misses,
+                    'in_flight': len(self._flights), 'cached': len(self._results), 'ttl': self.ttl}
+
+flights = SingleFlight()
+
+def run_query(query):
+    """Chạy một truy vấn, trả về kết quả hoặc raise QueryError.
+
+    Các câu khác nhau nhưng cùng nghĩa sau parse_query (cùng metric, field, symbol, currency, số ngày)
+    dùng chung một lần gọi n8n/cache.
+    """
+    with STAGE_SECONDS.time('parse'):
+        parsed = parse_query(query)
+    metric, field = workflow_shape(parsed)
+    params = webhook_params(parsed)
+    key = (metric, field, params['symbol'], params['currency'], params['limit'])
+    return flights.do(key, lambda: execute_query(metric, field, params))
+
+def get_workflow(metric, field):
+    try:
+        with STAGE_SECONDS.time('workflow'):
+            return registry.get(metric, field)
+    except WorkflowError as e:
+        print(f"Lỗi đăng ký workflow: {str(e)}")
+        raise QueryError(str(e))
+
+def execute_query(metric, field, params):
+    if ohlcv is not None:
+        try:
+            with STAGE_SECONDS.time('ohlcv_cache'):
+                result = ohlcv.aggregate(metric, field, params['symbol'], params['currency'], params['limit'])
+            print(f"Kết quả từ cache OHLCV: {result}")
+            ANSWER_TOTAL.inc('ohlcv_cache')
+            return result
+        except CacheMiss as e:
+            print(f"Cache OHLCV không dùng được, chuyển sang n8n: {str(e)}")
+            FALLBACK_TOTAL.inc('ohlcv_cache')
+    workflow = get_workflow(metric, field)
+    
+    # Try production webhook
+    webhook_url = f"{N8N_BASE_URL}/webhook/{workflow['path']}"
+    print(f"Đang gọi production webhook: {webhook_url} {params}")
+    with STAGE_SECONDS.time('webhook'):
+        response = call_webhook(webhook_url, params, 'webhook')
+    if response is not None and response.status_code == 404:
+        # Workflow bị xóa/tắt ngoài ứng dụng: đăng ký lại một lần
+        print("Webhook chưa đăng ký, đăng ký lại workflow...")
+        FALLBACK_TOTAL.inc('reregister')
+        registry.invalidate(metric, field)
+        workflow = get_workflow(metric, field)
+        with STAGE_SECONDS.time('webhook'):
+            response = call_webhook(webhook_url, params, 'webhook', retry_not_found=True)
+    
+    if response is not None and response.status_code == 200:
+        print("Đang xử lý phản hồi webhook...")
+        try:
+            result = extract_result(response.json())
+        except Exception as e:
+            print(f"Lỗi xử lý response webhook: {str(e)}")
+            raise QueryError(f'Lỗi xử lý response webhook: {str(e)}')
+        print(f"Kết quả: {result}")
+        ANSWER_TOTAL.inc('webhook')
+        return result
+    
+    # Try test webhook
+    print("Production webhook fail, thử test webhook...")
+    FALLBACK_TOTAL.inc('webhook')
+    test_webhook_url = f"{N8N_BASE_URL}/webhook-test/{workflow['path']}"
+    with STAGE_SECONDS.time('webhook_test'):
+        response = call_webhook(test_webhook_url, params, 'webhook_test')
+    
+    if response is not None and response.status_code == 200:
+        print("Đang xử lý phản hồi test webhook...")
+        try:
+            result = extract_result(response.json())
+        except Exception as e:
+            print(f"Lỗi xử lý response test webhook: {str(e)}")
+            raise QueryError(f'Lỗi xử lý response test webhook: {str(e)}')
+        print(f"Kết quả: {result}")
+        ANSWER_TOTAL.inc('webhook_test')
+        return result
+    
+    # Fallback to API run
+    print("Webhook fail, thử chạy workflow qua API run...")
+    FALLBACK_TOTAL.inc('webhook_test')
+    with STAGE_SECONDS.time('api_run'):
+        result = run_via_api(workflow, params)
+    ANSWER_TOTAL.inc('api_run')
+    return result
+
+def run_via_api(workflow, params):
+    run_url = f"{N8N_RUN_URL}/{workflow['id']}/run"
+    try:
+        # Không qua webhook nên truyền tham số bằng pinData của node Webhook
+        run_body = {'pinData': {'Webhook': [{'json': {'query': params}}]}}
+        exec_response = http.post(run_url, 'run', headers=N8N_HEADERS, json=run_body)
+    except requests.exceptions.RequestException as e:
+        print(f"Lỗi khi chạy API run: {str(e)}")
+        raise QueryError(f'Lỗi khi chạy API run: {str(e)}')
+    if exec_response.status_code != 200:
+        raise QueryError(f'Không thể chạy workflow qua API: {exec_response.text[:1000]}')
+    
+    execution_id = exec_response.json().get('data', {}).get('executionId')
+    if not execution_id:
+        print("Lỗi: Không tìm thấy execution_id")
+        raise QueryError('Không tìm thấy execution_id')
+    
+    # Poll execution result
+    print(f"Đang poll execution ID: {execution_id}")
+    for attempt in range(EXECUTION_CHECKS):
+        try:
+            result_response = http.get(f"{N8N_EXECUTIONS_URL}/{execution_id}", 'executions.get', headers=N8N_HEADERS)
+            if result_response.status_code == 200:
+                try:
+                    exec_data = result_response.json().get('data', {})
+                except ValueError as e:
+                    print(f"Lỗi phân tích JSON execution lần {attempt + 1}: {str(e)}, Response: {result_response.text[:1000]}")
+                    raise QueryError(f'Lỗi phân tích JSON execution: {result_response.text[:1000]}')
+                if exec_data.get('finished'):
+                    run_data = exec_data.get('resultData', {}).get('runData', {})
+                    calculate_node = run_data.get('Calculate', [{}])[0].get('data', {}).get('main', [[]])[0]
+                    if not calculate_node:
+                        print("Lỗi: Không tìm thấy kết quả từ node Calculate")
+                        raise QueryError('Không tìm thấy kết quả từ node Calculate')
+                    result = calculate_node[0].get('json', {}).get('result')
+                    print(f"Kết quả từ execution: {result}")
+                    return result
+        except requests.exceptions.RequestException:
+            pass
+        if attempt + 1 < EXECUTION_CHECKS:
+            POLL.sleep(attempt, 'execution')
+    print(f"Lỗi: Không thể lấy kết quả execution sau {EXECUTION_CHECKS} lần thử")
+    raise QueryError(f'Không thể lấy kết quả execution sau {EXECUTION_CHECKS} lần thử')
+
+class Job:
+    def __init__(self, query):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status, 'query': self.query}
+        if self.status == 'done':
+            data['result'] = self.result
+        elif self.status == 'error':
+            data['error'] = self.error
+        return data
+
+class JobsBusy(Exception):
+    pass
+
+class JobManager:
+    """Chạy truy vấn trong thread pool; request HTTP chỉ nhận job id rồi lấy kết quả sau."""
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL, max_pending=JOB_MAX_PENDING, max_tracked=JOB_MAX_TRACKED):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='n8n-job')
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_tracked = max_tracked
+        self._jobs = {}
+        self._pending = 0  # job đã nhận nhưng chưa xong (đang chờ trong hàng đợi của executor hoặc đang chạy)
+        self._lock = threading.Lock()
+
+    def submit(self, query):
+        job = Job(query)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                JOB_REJECTED.inc()
+                raise JobsBusy(f'Đang có {self._pending} truy vấn chờ xử lý, vui lòng thử lại sau')
+            self._cleanup()
+            self._jobs[job.id] = job
+            self._pending += 1
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _cleanup(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+        # Dict giữ thứ tự tạo: bỏ các job đã xong cũ nhất để còn chỗ cho job sắp thêm
+        excess = len(self._jobs) + 1 - self.max_tracked
+        if excess > 0:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+                del self._jobs[job_id]
+
+    def _run(self, job):
+        job.status = 'running'
+        started = time.time()
+        JOB_SECONDS.observe(started - job.created, 'queue')
+        try:
+            job.result = run_query(job.query)
+            job.status = 'done'
+        except QueryError as e:
+            job.error = str(e)
+            job.status = 'error'
+        except Exception as e:
+            print(f"Lỗi trong job {job.id}: {str(e)}")
+            job.error = f'Lỗi server nội bộ: {str(e)}'
+            job.status = 'error'
+        job.finished = time.time()
+        with self._lock:
+            self._pending -= 1
+        JOB_SECONDS.observe(job.finished - started, 'run')
+        JOB_TOTAL.inc(job.status)
+        job.done.set()
+
+jobs = JobManager()
+metrics.counter_func('query_flight_total', 'Truy vấn theo cách lấy kết quả: tự chạy, chờ chung, cache',
+                     lambda: {('miss',): flights.misses, ('shared',): flights.shared, ('hit',): flights.hits},
+                     ['result'])
+metrics.gauge_func('jobs_tracked', 'Số job đang giữ trong bộ nhớ', lambda: len(jobs._jobs))
+metrics.gauge_func('jobs_pending', 'Số job đang chờ hoặc đang chạy', lambda: jobs._pending)
+
+@app.route('/query-stats')
+def query_stats():
+    return jsonify(flights.stats())
+
+@app.route('/ohlcv-cache')
+def ohlcv_cache_stats():
+    if ohlcv is None:
+        return jsonify({'enabled': False, 'series': []})
+    return jsonify({'enabled': True, 'series': ohlcv.stats()})
+
 @app.route('/submit', methods=['POST'])
 def submit_query():
     query = request.form.get('query')
     print(f"Nhận được câu truy vấn: {query}")
-    
+    if not query:
+        return jsonify({'error': 'Thiếu câu truy vấn'}), 400
     try:
-        delete_old_workflows()  # Xóa workflows cũ
-        workflow_json, random_id = generate_workflow_json(query)
-        headers = {
-            'X-N8N-API-KEY': N8N_API_KEY,
-            'Content-Type': 'application/json'
-        }
-        
-        # Create workflow
-        print("Đang tạo workflow...")
-        response = requests.post(N8N_WORKFLOWS_URL, headers=headers, json=workflow_json, timeout=30)
-        print(f"Phản hồi tạo workflow: {response.status_code} - {response.text[:1000]}")
-        if response.status_code != 200:
-            return jsonify({'error': f'Không thể tạo workflow: {response.text[:1000]}'}), 500
-        
-        workflow_id = response.json().get('id')
-        if not workflow_id:
-            print("Lỗi: Không tìm thấy workflow_id")
-            return jsonify({'error': 'Không tìm thấy workflow_id'}), 500
-        print(f"Đã tạo workflow với ID: {workflow_id}")
-        
-        # Activate workflow
-        print("Đang kích hoạt workflow...")
-        try:
-            response = requests.post(f"{N8N_WORKFLOWS_URL}/{workflow_id}/activate", headers=headers, timeout=30)
-            print(f"Phản hồi kích hoạt workflow: {response.status_code} - {response.text[:1000]}")
-            if response.status_code != 200:
-                return jsonify({'error': f'Không thể kích hoạt workflow: {response.text[:1000]}'}), 500
-        except requests.exceptions.RequestException as e:
-            print(f"Lỗi khi kích hoạt workflow: {str(e)}")
-            return jsonify({'error': f'Lỗi khi kích hoạt workflow: {str(e)}'}), 500
-        
-        # Check activation status
-        print("Đang kiểm tra trạng thái kích hoạt workflow...")
-        activated = False
-        for attempt in range(10):
-            try:
-                response = requests.get(f"{N8N_WORKFLOWS_URL}/{workflow_id}", headers=headers, timeout=30)
-                print(f"Thử kiểm tra trạng thái lần {attempt + 1}: {response.status_code} - {response.text[:1000]}")
-                if response.status_code == 200:
-                    try:
-                        response_json = response.json()
-                        if response_json.get('active'):
-                            print("Workflow đã được kích hoạt!")
-                            activated = True
-                            break
-                    except ValueError as e:
-                        print(f"Lỗi phân tích JSON trạng thái workflow lần {attempt + 1}: {str(e)}, Response: {response.text[:1000]}")
-                        return jsonify({'error': f'Lỗi phân tích JSON trạng thái workflow: {response.text[:1000]}'}), 500
-                else:
-                    print(f"Trạng thái không phải 200: {response.status_code} - {response.text[:1000]}")
-            except requests.exceptions.RequestException as e:
-                print(f"Lỗi kiểm tra trạng thái lần {attempt + 1}: {str(e)}")
-            time.sleep(5)
-        
-        if not activated:
-            print("Lỗi: Workflow không thể kích hoạt sau 10 lần thử")
-            return jsonify({'error': 'Workflow không thể kích hoạt sau 10 lần thử'}), 500
-        
-        # Wait for webhook registration
-        print("Chờ 30 giây để webhook đăng ký...")
-        time.sleep(30)
-        
-        # Try production webhook
-        webhook_url = f"{N8N_BASE_URL}/webhook/crypto/{random_id}"
-        print(f"Webhook URL: {webhook_url}")
-        
-        print(f"Đang gọi production webhook: {webhook_url}")
-        response = None
-        for attempt in range(5):
-            try:
-                response = requests.get(webhook_url, timeout=30)
-                print(f"Thử gọi production webhook lần {attempt + 1}: {response.status_code} - {response.text[:1000]}")
-                if response.status_code == 200:
-                    break
-            except requests.exceptions.RequestException as e:
-                print(f"Lỗi gọi production webhook lần {attempt + 1}: {str(e)}")
-            time.sleep(5)
-        
-        if response and response.status_code == 200:
-            print("Đang xử lý phản hồi webhook...")
-            try:
-                result = response.json()[0]['json']['result']
-                print(f"Kết quả: {result}")
-                return jsonify({'result': result})
-            except Exception as e:
-                print(f"Lỗi xử lý response webhook: {str(e)}")
-                return jsonify({'error': f'Lỗi xử lý response webhook: {str(e)}'}), 500
-        
-        # Try test webhook
-        print("Production webhook fail, thử test webhook...")
-        test_webhook_url = f"{N8N_BASE_URL}/webhook-test/crypto/{random_id}"
-        response = None
-        for attempt in range(5):
-            try:
-                response = requests.get(test_webhook_url, timeout=30)
-                print(f"Thử gọi test webhook lần {attempt + 1}: {response.status_code} - {response.text[:1000]}")
-                if response.status_code == 200:
-                    break
-            except requests.exceptions.RequestException as e:
-                print(f"Lỗi gọi test webhook lần {attempt + 1}: {str(e)}")
-            time.sleep(5)
-        
-        if response and response.status_code == 200:
-            print("Đang xử lý phản hồi test webhook...")
-            try:
-                result = response.json()[0]['json']['result']
-                print(f"Kết quả: {result}")
-                return jsonify({'result': result})
-            except Exception as e:
-                print(f"Lỗi xử lý response test webhook: {str(e)}")
-                return jsonify({'error': f'Lỗi xử lý response test webhook: {str(e)}'}), 500
-        
-        # Fallback to API run
-        print("Webhook fail, thử chạy workflow qua API run...")
-        run_url = f"{N8N_RUN_URL}/{workflow_id}/run"
-        try:
-            exec_response = requests.post(run_url, headers=headers, json={}, timeout=30)
-            print(f"Phản hồi API run: {exec_response.status_code} - {exec_response.text[:1000]}")
-            if exec_response.status_code != 200:
-                return jsonify({'error': f'Không thể chạy workflow qua API: {exec_response.text[:1000]}'}), 500
-        except requests.exceptions.RequestException as e:
-            print(f"Lỗi khi chạy API run: {str(e)}")
-            return jsonify({'error': f'Lỗi khi chạy API run: {str(e)}'}), 500
-        
-        execution_id = exec_response.json().get('data', {}).get('executionId')
-        if not execution_id:
-            print("Lỗi: Không tìm thấy execution_id")
-            return jsonify({'error': 'Không tìm thấy execution_id'}), 500
-        
-        # Poll execution result
-        print(f"Đang poll execution ID: {execution_id}")
-        for attempt in range(10):
-            try:
-                result_response = requests.get(f"{N8N_EXECUTIONS_URL}/{execution_id}", headers=headers, timeout=30)
-                print(f"Thử kiểm tra execution lần {attempt + 1}: {result_response.status_code} - {result_response.text[:1000]}")
-                if result_response.status_code == 200:
-                    try:
-                        exec_data = result_response.json().get('data', {})
-                        if exec_data.get('finished'):
-                            run_data = exec_data.get('resultData', {}).get('runData', {})
-                            calculate_node = run_data.get('Calculate', [{}])[0].get('data', {}).get('main', [[]])[0]
-                            if calculate_node:
-                                result = calculate_node[0].get('json', {}).get('result')
-                                print(f"Kết quả từ execution: {result}")
-                                return jsonify({'result': result})
-                            else:
-                                print("Lỗi: Không tìm thấy kết quả từ node Calculate")
-                                return jsonify({'error': 'Không tìm thấy kết quả từ node Calculate'}), 500
-                    except ValueError as e:
-                        print(f"Lỗi phân tích JSON execution lần {attempt + 1}: {str(e)}, Response: {result_response.text[:1000]}")
-                        return jsonify({'error': f'Lỗi phân tích JSON execution: {result_response.text[:1000]}'}), 500
-                time.sleep(5)
-            except requests.exceptions.RequestException as e:
-                print(f"Lỗi kiểm tra execution lần {attempt + 1}: {str(e)}")
-        print("Lỗi: Không thể lấy kết quả execution sau 10 lần thử")
-        return jsonify({'error': 'Không thể lấy kết quả execution sau 10 lần thử'}), 500
-    
-    except Exception as e:
-        print(f"Lỗi trong submit_query: {str(e)}")
-        return jsonify({'error': f'Lỗi server nội bộ: {str(e)}'}), 500
+        job = jobs.submit(query)
+    except JobsBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(JOB_RETRY_AFTER)}
+    return jsonify({'job_id': job.id, 'status': job.status,
+                    'result_url': url_for('get_result', job_id=job.id)}), 202
+
+@app.route('/result/<job_id>')
+def get_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Không tìm thấy job'}), 404
+    # ?wait=N: giữ request tối đa N giây chờ job xong (long polling) thay vì hỏi lại liên tục
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_RESULT_WAIT)
+    except ValueError:
+        wait = 0
+    if wait > 0:
+        job.done.wait(wait)
+    data = job.to_dict()
+    if job.status == 'error':
+        return jsonify(data), 500
+    return jsonify(data), 200 if job.status == 'done' else 202
 
 if __name__ == '__main__':
+    # Đăng ký sẵn các workflow ở nền; n8n chưa sẵn sàng thì sẽ đăng ký khi có truy vấn đầu tiên.
+    # Với debug reloader chỉ tiến trình con (WERKZEUG_RUN_MAIN) phục vụ request.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Thread(target=warm_up, daemon=True).start()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Đo độ trễ đầu-cuối và thông lượng của /submit (gửi job rồi long-poll /result/<job_id>).
+
+    python bench_submit.py --url http://localhost:5000 --requests 500 --concurrency 50
+    python bench_submit.py --distinct --json result.json
+
+Mặc định các luồng gửi xen kẽ vài câu truy vấn cố định (đo cả hiệu quả gộp truy vấn/cache kết quả);
+--distinct thêm mã coin khác nhau cho từng request để mọi truy vấn đều phải chạy thật.
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+QUERIES = [
+    'max close price của BTC',
+    'avg close price của ETH',
+    'max volume của BTC in usd',
+    'avg giá của SOL từ 2023 đến nay',
+]
+POLL_WAIT = 25
+
+
+# percentile/summarize giống hệt nhau trong bench_counter.py (Week 4), bench_qa.py (Week 5) và
+# bench_submit.py (Week 6): mỗi tuần là một thư mục chạy độc lập nên chép thay vì import; sửa thì sửa cả ba
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 4),
+        'p50_ms': round(percentile(values, 50) * 1000, 4),
+        'p95_ms': round(percentile(values, 95) * 1000, 4),
+        'p99_ms': round(percentile(values, 99) * 1000, 4),
+        'max_ms': round(values[-1] * 1000, 4),
+    }
+
+
+class Worker:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def run(self, query):
+        """Trả (trạng thái, thời gian submit, thời gian tới khi có kết quả)."""
+        session = self.session()
+        start = time.perf_counter()
+        try:
+            response = session.post(f'{self.base_url}/submit', data={'query': query}, timeout=self.timeout)
+            submitted = time.perf_counter() - start
+            if response.status_code == 503:
+                return 'busy', submitted, None
+            if response.status_code != 202:
+                return 'submit_error', submitted, None
+            result_url = f"{self.base_url}{response.json()['result_url']}"
+            while True:
+                response = session.get(result_url, params={'wait': POLL_WAIT}, timeout=POLL_WAIT + self.timeout)
+                if response.status_code != 202:
+                    break
+                if time.perf_counter() - start > self.timeout:
+                    return 'timeout', submitted, None
+            status = 'ok' if response.status_code == 200 else 'error'
+            return status, submitted, time.perf_counter() - start
+        except requests.exceptions.RequestException:
+            return 'connection_error', time.perf_counter() - start, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /submit của Week 6')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=120, help='thời gian tối đa cho một truy vấn (giây)')
+    parser.add_argument('--distinct', action='store_true', help='mỗi request một mã coin khác nhau')
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    queries = []
+    for i in range(args.requests):
+        query = QUERIES[i % len(QUERIES)]
+        if args.distinct:
+            query = f'max close price của C{i}'
+        queries.append(query)
+
+    worker = Worker(args.url, args.timeout)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(worker.run, queries))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _, _ in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    completed = [total for status, _, total in outcomes if status == 'ok']
+    report = {
+        'url': args.url,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'distinct': args.distinct,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(completed) / elapsed, 2) if elapsed else None,
+        'statuses': statuses,
+        'submit': summarize([submitted for _, submitted, _ in outcomes]),
+        'end_to_end': summarize(completed),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
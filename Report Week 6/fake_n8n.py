@@ -0,0 +1,236 @@
+"""Máy chủ giả lập n8n + CryptoCompare để chạy và đo app.py mà không cần n8n, Postgres hay API key.
+
+Có đủ các route app.py dùng; mỗi nhóm route có độ trễ và tỉ lệ lỗi riêng để đi qua mọi nhánh dự phòng:
+
+    python fake_n8n.py --port 5679 --delay webhook=0.2 --fail webhook=0.3 --fail webhook_test=1
+    N8N_BASE_URL=http://localhost:5679 CRYPTOCOMPARE_URL=http://localhost:5679 python app.py
+
+Nhóm route: workflows, activate, webhook, webhook_test, run, executions, histoday.
+Cấu hình đổi được lúc chạy qua POST /_config (JSON {"delay": {...}, "fail": {...}}), thống kê ở GET /_stats.
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+import zlib
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+ROUTES = ('workflows', 'activate', 'webhook', 'webhook_test', 'run', 'executions', 'histoday')
+DAY = 86400
+
+config = {'delay': {}, 'fail': {}, 'execution_time': 0.5}
+state = {'workflows': {}, 'executions': {}}
+stats = {route: {'calls': 0, 'failures': 0} for route in ROUTES}
+lock = threading.Lock()
+ids = itertools.count(1)
+
+
+def simulate(route):
+    """Chờ theo độ trễ cấu hình; trả True nếu lần gọi này phải lỗi."""
+    delay = config['delay'].get(route, 0)
+    if delay:
+        time.sleep(delay)
+    failed = random.random() < config['fail'].get(route, 0)
+    with lock:
+        stats[route]['calls'] += 1
+        stats[route]['failures'] += failed
+    return failed
+
+
+def failure():
+    return jsonify({'message': 'Lỗi giả lập'}), 500
+
+
+def candles(symbol, currency, limit, now=None):
+    # Giá mỗi ngày cố định theo (symbol, currency, ngày) để các lần gọi cho cùng kết quả
+    today = int(now if now is not None else time.time()) // DAY * DAY
+    base = 10 + zlib.crc32(f'{symbol}/{currency}'.encode()) % 50000
+    data = []
+    for day in range(today - limit * DAY, today + 1, DAY):
+        rng = random.Random(f'{symbol}/{currency}/{day}')
+        close = round(base * (0.5 + rng.random()), 2)
+        data.append({'time': day, 'close': close, 'volumeto': round(close * rng.uniform(1e3, 1e5), 2)})
+    return data
+
+
+def calculate(workflow, query):
+    # Giống node Calculate: avg/max của trường trên toàn bộ nến trả về
+    metric, field = workflow['shape']
+    values = [item[field] for item in candles(query.get('symbol', 'BTC'), query.get('currency', 'USD'),
+                                               int(query.get('limit', 365)))]
+    return sum(values) / len(values) if metric == 'avg' else max(values)
+
+
+def find_by_path(path, active_only=True):
+    with lock:
+        for workflow in state['workflows'].values():
+            if workflow['path'] == path and (workflow['active'] or not active_only):
+                return workflow
+    return None
+
+
+def public(workflow):
+    return {key: workflow[key] for key in ('id', 'name', 'active', 'nodes')}
+
+
+@app.route('/api/v1/workflows', methods=['GET', 'POST'])
+def workflows():
+    if simulate('workflows'):
+        return failure()
+    if request.method == 'GET':
+        with lock:
+            workflows = list(state['workflows'].values())
+        # Phân trang như n8n API: limit + nextCursor (ở đây con trỏ là vị trí trong danh sách)
+        limit = int(request.args.get('limit', 100))
+        start = int(request.args.get('cursor', 0))
+        next_cursor = str(start + limit) if start + limit < len(workflows) else None
+        return jsonify({'data': [public(w) for w in workflows[start:start + limit]], 'nextCursor': next_cursor})
+    body = request.get_json()
+    webhook = body['nodes'][0]['parameters']
+    # path dạng crypto/<metric>-<field>/<mã băm định nghĩa>
+    metric, field = webhook['path'].split('/')[1].split('-', 1)
+    workflow = {'id': str(next(ids)), 'name': body['name'], 'active': False, 'nodes': body['nodes'],
+                'path': webhook['path'], 'shape': (metric, field)}
+    with lock:
+        state['workflows'][workflow['id']] = workflow
+    return jsonify(public(workflow))
+
+
+@app.route('/api/v1/workflows/<workflow_id>', methods=['GET', 'DELETE'])
+def workflow_detail(workflow_id):
+    if simulate('workflows'):
+        return failure()
+    with lock:
+        workflow = state['workflows'].get(workflow_id)
+        if workflow is None:
+            return jsonify({'message': 'Not found'}), 404
+        if request.method == 'DELETE':
+            del state['workflows'][workflow_id]
+        return jsonify(public(workflow))
+
+
+@app.route('/api/v1/workflows/<workflow_id>/activate', methods=['POST'])
+def activate(workflow_id):
+    if simulate('activate'):
+        return failure()
+    with lock:
+        workflow = state['workflows'].get(workflow_id)
+        if workflow is None:
+            return jsonify({'message': 'Not found'}), 404
+        workflow['active'] = True
+        return jsonify(public(workflow))
+
+
+@app.route('/webhook/<path:path>')
+def webhook(path):
+    if simulate('webhook'):
+        return failure()
+    workflow = find_by_path(path)
+    if workflow is None:
+        return jsonify({'message': 'Webhook chưa đăng ký'}), 404
+    return jsonify({'result': calculate(workflow, request.args)})
+
+
+@app.route('/webhook-test/<path:path>')
+def webhook_test(path):
+    if simulate('webhook_test'):
+        return failure()
+    workflow = find_by_path(path, active_only=False)
+    if workflow is None:
+        return jsonify({'message': 'Webhook test chưa đăng ký'}), 404
+    return jsonify({'result': calculate(workflow, request.args)})
+
+
+@app.route('/rest/workflows/<workflow_id>/run', methods=['POST'])
+def run(workflow_id):
+    if simulate('run'):
+        return failure()
+    with lock:
+        workflow = state['workflows'].get(workflow_id)
+    if workflow is None:
+        return jsonify({'message': 'Not found'}), 404
+    query = request.get_json()['pinData']['Webhook'][0]['json']['query']
+    execution_id = str(next(ids))
+    with lock:
+        state['executions'][execution_id] = {
+            'finish_at': time.time() + config['execution_time'],
+            'result': calculate(workflow, query),
+        }
+    return jsonify({'data': {'executionId': execution_id}})
+
+
+@app.route('/api/v1/executions/<execution_id>')
+def execution(execution_id):
+    if simulate('executions'):
+        return failure()
+    with lock:
+        entry = state['executions'].get(execution_id)
+    if entry is None:
+        return jsonify({'message': 'Not found'}), 404
+    if time.time() < entry['finish_at']:
+        return jsonify({'data': {'finished': False}})
+    run_data = {'Calculate': [{'data': {'main': [[{'json': {'result': entry['result']}}]]}}]}
+    return jsonify({'data': {'finished': True, 'resultData': {'runData': run_data}}})
+
+
+@app.route('/data/histoday')
+def histoday():
+    if simulate('histoday'):
+        return failure()
+    data = candles(request.args.get('fsym', 'BTC'), request.args.get('tsym', 'USD'),
+                   int(request.args.get('limit', 30)))
+    return jsonify({'Response': 'Success', 'Data': {'Data': data}})
+
+
+@app.route('/_config', methods=['GET', 'POST'])
+def update_config():
+    if request.method == 'POST':
+        body = request.get_json() or {}
+        with lock:
+            for key in ('delay', 'fail'):
+                config[key].update(body.get(key, {}))
+            if 'execution_time' in body:
+                config['execution_time'] = float(body['execution_time'])
+    return jsonify(config)
+
+
+@app.route('/_stats')
+def get_stats():
+    with lock:
+        return jsonify(stats)
+
+
+def parse_pairs(values, name):
+    result = {}
+    for value in values:
+        route, _, number = value.partition('=')
+        if route not in ROUTES:
+            raise SystemExit(f'--{name}: route không hợp lệ {route!r} (chọn trong {", ".join(ROUTES)})')
+        result[route] = float(number)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Máy chủ giả lập n8n + CryptoCompare')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5679)
+    parser.add_argument('--delay', action='append', default=[], metavar='ROUTE=GIÂY')
+    parser.add_argument('--fail', action='append', default=[], metavar='ROUTE=TỈ_LỆ')
+    parser.add_argument('--execution-time', type=float, default=0.5,
+                        help='thời gian một execution qua API run chạy xong (giây)')
+    parser.add_argument('--seed', type=int, default=None, help='seed cho lỗi ngẫu nhiên')
+    args = parser.parse_args()
+    config['delay'] = parse_pairs(args.delay, 'delay')
+    config['fail'] = parse_pairs(args.fail, 'fail')
+    config['execution_time'] = args.execution_time
+    if args.seed is not None:
+        random.seed(args.seed)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Timeout (kết nối, đọc) theo endpoint; webhook chờ n8n gọi CryptoCompare nên đọc lâu hơn
+DEFAULT_TIMEOUT = (3.05, 30)
+ENDPOINT_TIMEOUTS = {
+    'workflows.list': (3.05, 10),
+    'workflows.get': (3.05, 10),
+    'workflows.create': (3.05, 30),
+    'workflows.activate': (3.05, 30),
+    'workflows.delete': (3.05, 10),
+    'webhook': (3.05, 60),
+    'webhook_test': (3.05, 60),
+    'run': (3.05, 30),
+    'executions.get': (3.05, 10),
+    'cryptocompare.histoday': (3.05, 20),
+}
+# Mã lỗi tạm thời nên thử lại
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+UPSTREAM_SECONDS = metrics.histogram('upstream_request_seconds', 'Thời gian gọi n8n/CryptoCompare theo endpoint',
+                                     ['endpoint', 'status'])
+UPSTREAM_RETRIES = metrics.counter('upstream_retries_total', 'Số lần thử lại request theo endpoint', ['endpoint'])
+SLEEP_SECONDS = metrics.histogram('backoff_sleep_seconds', 'Thời gian ngủ chờ giữa các lần thử/poll', ['reason'])
+
+
+class RetryPolicy:
+    """Số lần thử và thời gian chờ giữa các lần: base, gấp đôi mỗi lần, tối đa cap giây (có jitter)."""
+
+    def __init__(self, attempts=1, base=0.5, cap=8, statuses=RETRY_STATUSES):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+
+    def delay(self, attempt):
+        delay = min(self.cap, self.base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def sleep(self, attempt, reason):
+        delay = self.delay(attempt)
+        SLEEP_SECONDS.observe(delay, reason)
+        time.sleep(delay)
+
+
+NO_RETRY = RetryPolicy()
+
+
+class HttpClient:
+    """Session HTTP dùng chung (pool kết nối keep-alive) cho mọi lời gọi tới n8n và CryptoCompare.
+
+    Timeout, chính sách thử lại và đo độ trễ (metrics) được áp dụng theo tên endpoint tại một chỗ.
+    """
+
+    def __init__(self, pool_size=32, timeouts=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+
+    def request(self, method, url, endpoint, retry=NO_RETRY, **kwargs):
+        """Gửi request, thử lại khi lỗi kết nối hoặc mã nằm trong retry.statuses.
+
+        Trả về response cuối cùng (kể cả khi mã lỗi); raise RequestException nếu lần cuối lỗi kết nối.
+        """
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, DEFAULT_TIMEOUT))
+        for attempt in range(retry.attempts):
+            last = attempt + 1 == retry.attempts
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint, 'error')
+                print(f"Lỗi gọi {endpoint} lần {attempt + 1}: {str(e)}")
+                if last:
+                    raise
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint, str(response.status_code))
+                print(f"Phản hồi {endpoint} lần {attempt + 1}: {response.status_code} - {response.text[:1000]}")
+                if last or response.status_code not in retry.statuses:
+                    return response
+            UPSTREAM_RETRIES.inc(endpoint)
+            retry.sleep(attempt, 'retry')
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def post(self, url, endpoint, **kwargs):
+        return self.request('POST', url, endpoint, **kwargs)
+
+    def delete(self, url, endpoint, **kwargs):
+        return self.request('DELETE', url, endpoint, **kwargs)
@@ -0,0 +1,210 @@
+"""Đo đạc nhẹ cho ứng dụng Flask, xuất dạng văn bản Prometheus tại /metrics.
+
+Không phụ thuộc thư viện ngoài; mỗi lần ghi chỉ là một lần khóa và cộng số. File này được chép
+giống hệt vào Report Week 4, Report Week 5/project và Report Week 6 (mỗi tuần chạy độc lập, không
+import chéo thư mục); sửa thì sửa cả ba bản. Ví dụ:
+
+    STAGE_SECONDS = histogram('qa_stage_seconds', 'Thời gian từng bước', ['stage'])
+    with STAGE_SECONDS.time('parse'):
+        ...
+    CACHE_TOTAL = counter('cache_requests_total', 'Lượt tra cache', ['cache', 'result'])
+    CACHE_TOTAL.inc('plan', 'hit')
+    instrument_app(app)  # độ trễ theo route + route /metrics
+"""
+import bisect
+import os
+import threading
+import time
+
+from flask import Response, request
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_metrics = []
+_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in items]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # nhãn -> [số đếm theo bucket (không cộng dồn)..., +Inf, tổng]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, list(row)) for labels, row in self._values.items())
+        lines = []
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), row):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(row[-1])}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Callback:
+    """Giá trị đọc lúc xuất /metrics (kích thước hàng đợi, số đếm có sẵn trong đối tượng khác...).
+
+    fn trả về một số, hoặc dict {tuple nhãn: số} khi có labelnames.
+    """
+
+    def __init__(self, name, documentation, kind, fn, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in sorted(values.items())]
+
+
+def _register(metric):
+    with _lock:
+        for existing in _metrics:
+            if existing.name == metric.name:
+                return existing
+        _metrics.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge_func(name, documentation, fn, labelnames=()):
+    return _register(Callback(name, documentation, 'gauge', fn, labelnames))
+
+
+def counter_func(name, documentation, fn, labelnames=()):
+    return _register(Callback(name, documentation, 'counter', fn, labelnames))
+
+
+def render():
+    with _lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        kind = getattr(metric, 'kind', None) or ('histogram' if isinstance(metric, Histogram) else 'counter')
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _reset_locks():
+    # Sau fork tiến trình con chỉ còn luồng đã gọi fork; khóa do luồng khác giữ lúc đó không bao giờ
+    # được nhả, nên tạo khóa mới để tiến trình con ghi metric không bị treo
+    global _lock
+    _lock = threading.Lock()
+    for metric in _metrics:
+        if hasattr(metric, '_lock'):
+            metric._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+REQUEST_SECONDS = histogram('http_request_duration_seconds', 'Thời gian xử lý request theo route',
+                            ['method', 'route', 'status'])
+
+
+def instrument_app(app, path='/metrics'):
+    """Đo thời gian mọi request theo route (mẫu URL, không phải URL thật) và thêm route /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        request.environ['metrics.start'] = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = request.environ.get('metrics.start')
+        if start is not None:
+            # Response dạng stream chỉ tính tới lúc bắt đầu gửi
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+        return response
+
+    @app.route(path)
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    return app
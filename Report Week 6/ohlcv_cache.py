@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import time
+
+import requests
+
+CRYPTOCOMPARE_HISTODAY_URL = 'https://min-api.cryptocompare.com/data/histoday'
+DAY = 86400
+# Lần gọi histoday tối đa 2000 nến
+MAX_HISTODAY_LIMIT = 2000
+
+UPSERT_SQL = '''
+    INSERT INTO candles (symbol, currency, day, close, volumeto) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(symbol, currency, day) DO UPDATE SET close = excluded.close, volumeto = excluded.volumeto
+'''
+
+SERIES_SQL = '''
+    INSERT INTO series (symbol, currency, fetched_at) VALUES (?, ?, ?)
+    ON CONFLICT(symbol, currency) DO UPDATE SET fetched_at = excluded.fetched_at
+'''
+
+COVERAGE_SQL = '''
+    SELECT MIN(c.day), MAX(c.day), s.fetched_at FROM series s
+    LEFT JOIN candles c ON c.symbol = s.symbol AND c.currency = s.currency
+    WHERE s.symbol = ? AND s.currency = ?
+'''
+
+# Cùng cách tính với node Calculate của workflow n8n (limit=N -> N+1 nến, tính cả hôm nay)
+AGGREGATES = {'avg': 'AVG', 'max': 'MAX'}
+FIELDS = ('close', 'volumeto')
+
+
+class CacheMiss(Exception):
+    """Cache không đủ dữ liệu và không lấy được thêm từ CryptoCompare."""
+
+
+def today_start(now=None):
+    now = int(now if now is not None else time.time())
+    return now // DAY * DAY
+
+
+class OhlcvCache:
+    """Chuỗi nến ngày theo (symbol, currency) lưu trong SQLite.
+
+    Lần đầu lấy đủ lịch sử, các lần sau chỉ lấy thêm những ngày còn thiếu; avg/max tính tại chỗ.
+    Nến hôm nay chưa đóng nên được làm mới sau mỗi `refresh` giây. Khi CryptoCompare lỗi,
+    dữ liệu đã có vẫn được dùng (có thể cũ) nếu phủ đủ khoảng thời gian cần.
+    """
+
+    def __init__(self, db_file, http, api_key=None, refresh=300, url=CRYPTOCOMPARE_HISTODAY_URL):
+        self.db_file = db_file
+        self.url = url
+        self.http = http
+        self.api_key = api_key
+        self.refresh = refresh
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._series_locks = {}
+        self.init_db()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def init_db(self):
+        with self.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS candles (
+                    symbol TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    close REAL NOT NULL,
+                    volumeto REAL NOT NULL,
+                    PRIMARY KEY (symbol, currency, day)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS series (
+                    symbol TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, currency)
+                )
+            ''')
+
+    def _series_lock(self, key):
+        with self._lock:
+            return self._series_locks.setdefault(key, threading.Lock())
+
+    def coverage(self, symbol, currency):
+        """(ngày đầu, ngày cuối, lần lấy gần nhất) hoặc None nếu chưa có dữ liệu."""
+        row = self.connection().execute(COVERAGE_SQL, (symbol, currency)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row
+
+    def fetch(self, symbol, currency, limit):
+        params = {'fsym': symbol, 'tsym': currency, 'limit': min(limit, MAX_HISTODAY_LIMIT)}
+        if self.api_key:
+            params['api_key'] = self.api_key
+        response = self.http.get(self.url, 'cryptocompare.histoday', params=params)
+        if response.status_code != 200:
+            raise CacheMiss(f'CryptoCompare trả mã {response.status_code}')
+        payload = response.json()
+        if payload.get('Response') == 'Error':
+            raise CacheMiss(f"CryptoCompare lỗi: {payload.get('Message')}")
+        data = payload.get('Data')
+        if isinstance(data, dict):
+            data = data.get('Data')
+        if not isinstance(data, list) or not data:
+            raise CacheMiss('CryptoCompare không trả dữ liệu')
+        return [(symbol, currency, int(item['time']), float(item['close']), float(item['volumeto']))
+                for item in data]
+
+    def ensure(self, symbol, currency, limit, now=None):
+        """Bảo đảm cache có các ngày [hôm nay - limit, hôm nay]; raise CacheMiss nếu không thể."""
+        now = now if now is not None else time.time()
+        today = today_start(now)
+        start = today - limit * DAY
+        with self._series_lock((symbol, currency)):
+            coverage = self.coverage(symbol, currency)
+            covered = coverage is not None and coverage[0] <= start
+            if covered and coverage[1] >= today and now - coverage[2] < self.refresh:
+                return
+            if covered:
+                # Chỉ lấy từ ngày cuối đã có (nến đó có thể chưa đóng) tới hôm nay
+                missing = max((today - coverage[1]) // DAY, 1)
+            else:
+                missing = limit
+            try:
+                rows = self.fetch(symbol, currency, missing)
+            except (CacheMiss, requests.exceptions.RequestException, ValueError, KeyError) as e:
+                if covered:
+                    print(f"Không làm mới được {symbol}/{currency}, dùng dữ liệu đã lưu: {str(e)}")
+                    return
+                raise CacheMiss(str(e))
+            with self.connection() as conn:
+                conn.executemany(UPSERT_SQL, rows)
+                conn.execute(SERIES_SQL, (symbol, currency, now))
+            if not covered and min(row[2] for row in rows) > start:
+                raise CacheMiss(f'CryptoCompare chỉ trả {len(rows)} ngày cho {symbol}/{currency}')
+
+    def aggregate(self, metric, field, symbol, currency, limit, now=None):
+        if metric not in AGGREGATES or field not in FIELDS:
+            raise CacheMiss(f'Không hỗ trợ {metric}/{field}')
+        self.ensure(symbol, currency, limit, now)
+        start = today_start(now) - limit * DAY
+        row = self.connection().execute(
+            f'SELECT {AGGREGATES[metric]}({field}) FROM candles WHERE symbol = ? AND currency = ? AND day >= ?',
+            (symbol, currency, start)).fetchone()
+        if row[0] is None:
+            raise CacheMiss(f'Chưa có dữ liệu cho {symbol}/{currency}')
+        return row[0]
+
+    def stats(self):
+        rows = self.connection().execute(
+            'SELECT s.symbol, s.currency, COUNT(c.day), MIN(c.day), MAX(c.day), s.fetched_at FROM series s '
+            'LEFT JOIN candles c ON c.symbol = s.symbol AND c.currency = s.currency '
+            'GROUP BY s.symbol, s.currency ORDER BY s.symbol, s.currency').fetchall()
+        return [{'symbol': s, 'currency': c, 'days': n, 'from': lo, 'to': hi, 'fetched_at': f}
+                for s, c, n, lo, hi, f in rows]